@@ -0,0 +1,175 @@
+"""
+An append-only archive of every fetched paper and its GPT scores, partitioned by day.
+Each day is a directory of numpy columns (arxiv id, relevance, novelty, selected) plus a jsonl file with the full
+records and an array of their byte offsets. Queries memory-map the columns of the days in range, filter them with
+numpy and only read the records that match, so answering a query never loads the whole history.
+
+python archive.py --days 90 --min-relevance 8
+"""
+
+import argparse
+import configparser
+import json
+import os
+import shutil
+from datetime import date, timedelta
+from typing import Dict, Iterator, List
+
+import numpy as np
+
+from arxiv_scraper import Paper
+
+# relevance and novelty of papers that were never scored by GPT
+UNSCORED = -1
+ID_DTYPE = "S16"
+DAY_FORMAT = "%Y-%m-%d"
+COLUMNS = ["arxiv_id", "relevance", "novelty", "selected", "offsets"]
+
+
+class PaperArchive:
+    def __init__(self, archive_dir: str):
+        self.archive_dir = archive_dir
+        os.makedirs(archive_dir, exist_ok=True)
+
+    def day_dir(self, day: date) -> str:
+        return os.path.join(self.archive_dir, day.strftime(DAY_FORMAT))
+
+    def days(self) -> List[date]:
+        days = []
+        for name in sorted(os.listdir(self.archive_dir)):
+            try:
+                day = date.fromisoformat(name)
+            except ValueError:
+                # skips partitions that are still being written
+                continue
+            days.append(day)
+        return days
+
+    def write_day(
+        self,
+        day: date,
+        papers: List[Paper],
+        scores: Dict[str, dict],
+        selected_papers: Dict[str, dict],
+    ):
+        """
+        Writes the partition of one day. Rerunning a day replaces its partition, older days are never touched.
+        :param scores: arxiv id -> GPT score dict with RELEVANCE, NOVELTY and COMMENT, for the papers that were scored
+        :param selected_papers: arxiv id -> dict of the papers that made it into the output
+        """
+        tmp_dir = self.day_dir(day) + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        relevance = np.full(len(papers), UNSCORED, dtype=np.int8)
+        novelty = np.full(len(papers), UNSCORED, dtype=np.int8)
+        offsets = np.zeros(len(papers) + 1, dtype=np.int64)
+        with open(os.path.join(tmp_dir, "records.jsonl"), "wb") as f:
+            for i, paper in enumerate(papers):
+                record = paper.to_dict()
+                score = scores.get(paper.arxiv_id)
+                if score is not None:
+                    relevance[i] = int(score["RELEVANCE"])
+                    novelty[i] = int(score["NOVELTY"])
+                    record["COMMENT"] = score.get("COMMENT")
+                elif paper.arxiv_id in selected_papers:
+                    record["COMMENT"] = selected_papers[paper.arxiv_id].get("COMMENT")
+                line = (json.dumps(record) + "\n").encode("utf-8")
+                f.write(line)
+                offsets[i + 1] = offsets[i] + len(line)
+        columns = {
+            "arxiv_id": np.array(
+                [paper.arxiv_id.encode("ascii") for paper in papers], dtype=ID_DTYPE
+            ),
+            "relevance": relevance,
+            "novelty": novelty,
+            "selected": np.array(
+                [paper.arxiv_id in selected_papers for paper in papers], dtype=bool
+            ),
+            "offsets": offsets,
+        }
+        for name, column in columns.items():
+            np.save(os.path.join(tmp_dir, name + ".npy"), column)
+        # swap the finished partition in, so readers never see a half written day
+        day_dir = self.day_dir(day)
+        if os.path.exists(day_dir):
+            shutil.rmtree(day_dir)
+        os.replace(tmp_dir, day_dir)
+
+    def columns(self, day: date) -> Dict[str, np.ndarray]:
+        # memory-mapped columns of one day, nothing is read until the arrays are used
+        return {
+            name: np.load(os.path.join(self.day_dir(day), name + ".npy"), mmap_mode="r")
+            for name in COLUMNS
+        }
+
+    def read_records(self, day: date, rows: np.ndarray) -> Iterator[dict]:
+        offsets = self.columns(day)["offsets"]
+        with open(os.path.join(self.day_dir(day), "records.jsonl"), "rb") as f:
+            for row in rows:
+                f.seek(offsets[row])
+                yield json.loads(f.read(offsets[row + 1] - offsets[row]))
+
+    def query(
+        self,
+        since: date = None,
+        until: date = None,
+        min_relevance: int = None,
+        min_novelty: int = None,
+        selected_only: bool = False,
+    ) -> Iterator[dict]:
+        """
+        Yields the records of the matching papers, oldest day first, with their scores and day added.
+        :param since: first day to include, defaults to the first archived day
+        :param until: last day to include, defaults to the last archived day
+        """
+        for day in self.days():
+            if (since is not None and day < since) or (
+                until is not None and day > until
+            ):
+                continue
+            columns = self.columns(day)
+            mask = np.ones(len(columns["arxiv_id"]), dtype=bool)
+            if min_relevance is not None:
+                mask &= columns["relevance"] >= min_relevance
+            if min_novelty is not None:
+                mask &= columns["novelty"] >= min_novelty
+            if selected_only:
+                mask &= columns["selected"]
+            rows = np.flatnonzero(mask)
+            for row, record in zip(rows, self.read_records(day, rows)):
+                yield {
+                    **record,
+                    "RELEVANCE": int(columns["relevance"][row]),
+                    "NOVELTY": int(columns["novelty"][row]),
+                    "day": day.strftime(DAY_FORMAT),
+                }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--archive-dir", help="defaults to archive_dir in the config")
+    parser.add_argument("--days", type=int, default=90, help="look back this many days")
+    parser.add_argument("--min-relevance", type=int)
+    parser.add_argument("--min-novelty", type=int)
+    parser.add_argument("--selected-only", action="store_true")
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read("configs/config.ini")
+    archive = PaperArchive(args.archive_dir or config["ARCHIVE"]["archive_dir"])
+    for record in archive.query(
+        since=date.today() - timedelta(days=args.days),
+        min_relevance=args.min_relevance,
+        min_novelty=args.min_novelty,
+        selected_only=args.selected_only,
+    ):
+        print(
+            "%s %s R%d N%d %s"
+            % (
+                record["day"],
+                record["arxiv_id"],
+                record["RELEVANCE"],
+                record["NOVELTY"],
+                record["title"],
+            )
+        )
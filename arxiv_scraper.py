@@ -1,24 +1,37 @@
 import configparser
 import dataclasses
 import json
+import os
+import threading
+import time
 from datetime import datetime, timedelta
 from html import unescape
-from typing import List, Optional
+from typing import Iterator, List, Optional
 import re
+import sys
 import arxiv
 
 import feedparser
+import requests
+from requests.adapters import HTTPAdapter
 from dataclasses import dataclass
 
+from disk_cache import DiskCache, MISSING
+from rate_limit import request_with_backoff
+from telemetry import metrics
+
 
 class EnhancedJSONEncoder(json.JSONEncoder):
     def default(self, o):
+        if isinstance(o, Paper):
+            return o.to_dict()
         if dataclasses.is_dataclass(o):
             return dataclasses.asdict(o)
         return super().default(o)
 
 
-@dataclass
+# slots drop the per-instance __dict__, which matters when months of papers are held in memory for a backfill
+@dataclass(slots=True)
 class Paper:
     # paper class should track the list of authors, paper title, abstract, arxiv id
     authors: List[str]
@@ -26,10 +39,23 @@ class Paper:
     abstract: str
     arxiv_id: str
 
+    def __post_init__(self):
+        # the same authors show up on many papers (and as keys of all_authors), so keep one copy of each name
+        self.authors = [sys.intern(author) for author in self.authors]
+
     # add a hash function using arxiv_id
     def __hash__(self):
         return hash(self.arxiv_id)
 
+    def to_dict(self) -> dict:
+        # unlike dataclasses.asdict this does not deep copy the fields, the author list is shared with the paper
+        return {
+            "authors": self.authors,
+            "title": self.title,
+            "abstract": self.abstract,
+            "arxiv_id": self.arxiv_id,
+        }
+
 
 def is_earlier(ts1, ts2):
     # compares two arxiv ids, returns true if ts1 is older than ts2
@@ -70,19 +96,187 @@ def get_papers_from_arxiv_api(area: str, timestamp, last_id) -> List[Paper]:
     return api_papers
 
 
-def get_papers_from_arxiv_rss(area: str, config: Optional[dict]) -> List[Paper]:
-    # get the feed from http://export.arxiv.org/rss/ and use the updated timestamp to avoid duplicates
-    updated = datetime.utcnow() - timedelta(days=1)
-    # format this into the string format 'Fri, 03 Nov 2023 00:30:00 GMT'
-    updated_string = updated.strftime("%a, %d %b %Y %H:%M:%S GMT")
-    feed = feedparser.parse(
-        f"http://export.arxiv.org/rss/{area}", modified=updated_string
-    )
-    if feed.status == 304:
-        if (config is not None) and config["OUTPUT"]["debug_messages"]:
-            print("No new papers since " + updated_string + " for " + area)
-        # if there are no new papers return an empty list
+class FeedFetcher:
+    """
+    Fetches arxiv rss feeds with conditional GETs. The ETag and Last-Modified of every feed are kept between runs,
+    so a feed that has not changed since the last run costs a single 304 response.
+    New validators only become the ones sent next time once commit() is called, i.e. after the run has
+    finished successfully, so a run that fails halfway does not lose the day's papers.
+    """
+
+    feed_url = "http://export.arxiv.org/rss/{area}"
+
+    def __init__(self, config: Optional[dict] = None, pool_size: int = 8):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.timeout = 60
+        self.state = None
+        if config is not None and config["CACHE"].getboolean("feed_state"):
+            self.state = DiskCache(
+                os.path.join(config["CACHE"]["cache_dir"], "feeds.sqlite3"),
+                namespace="feed_validators",
+                ttl=float(config["CACHE"]["feed_state_ttl_days"]) * 24 * 60 * 60,
+            )
+        # area -> validators to persist on commit, and area -> status, latency and size of the last fetch
+        self.pending = {}
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def conditional_headers(self, area: str) -> dict:
+        validators = MISSING if self.state is None else self.state.get(area)
+        if validators is MISSING:
+            # we have never seen this feed, so only ask for it if it changed within the last day
+            updated = datetime.utcnow() - timedelta(days=1)
+            # format this into the string format 'Fri, 03 Nov 2023 00:30:00 GMT'
+            return {"If-Modified-Since": updated.strftime("%a, %d %b %Y %H:%M:%S GMT")}
+        headers = {}
+        if validators.get("etag") is not None:
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified") is not None:
+            headers["If-Modified-Since"] = validators["last_modified"]
+        return headers
+
+    def fetch(self, area: str):
+        """
+        Requests the feed without downloading its body up front, retrying on 429s and server errors.
+        :return: the http status and an iterator over the chunks of the body, which is empty for a 304 and for
+        a feed that could not be fetched
+        """
+        start = time.perf_counter()
+        try:
+            with metrics.span("fetch_feed"):
+                response = request_with_backoff(
+                    self.session,
+                    "GET",
+                    self.feed_url.format(area=area),
+                    headers=self.conditional_headers(area),
+                    timeout=self.timeout,
+                    stream=True,
+                )
+        except requests.RequestException as ex:
+            # one category missing from the day's papers is better than no papers at all
+            status = 0 if ex.response is None else ex.response.status_code
+            print("Warning: could not fetch the feed for " + area + ": " + str(ex))
+            metrics.count("feeds_failed", status=status)
+            self.record_stats(area, status, start, 0)
+            return status, iter(())
+        # a 304 means the feed has not changed since the last run
+        metrics.count("feeds_fetched", status=response.status_code)
+        if response.status_code == 200:
+            with self._lock:
+                self.pending[area] = {
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                }
+            return response.status_code, self.read_body(area, response, start)
+        response.close()
+        self.record_stats(area, response.status_code, start, 0)
+        return response.status_code, iter(())
+
+    def read_body(self, area: str, response, start: float) -> Iterator[bytes]:
+        # yields the body as it downloads, and releases the connection once it has been read
+        size = 0
+        try:
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                size += len(chunk)
+                yield chunk
+        finally:
+            response.close()
+            self.record_stats(area, response.status_code, start, size)
+
+    def record_stats(self, area: str, status: int, start: float, size: int):
+        with self._lock:
+            self.stats[area] = {
+                "status": status,
+                "seconds": time.perf_counter() - start,
+                "bytes": size,
+            }
+
+    def report(self):
+        for area, stats in self.stats.items():
+            print(
+                "Fetched %s: status %d, %.2fs, %d bytes"
+                % (area, stats["status"], stats["seconds"], stats["bytes"])
+            )
+        print(
+            "Fetched %d feeds, %d bytes in total"
+            % (len(self.stats), sum(stats["bytes"] for stats in self.stats.values()))
+        )
+
+    def commit(self):
+        if self.state is not None:
+            for area, validators in self.pending.items():
+                self.state.set(area, validators)
+        self.pending = {}
+
+    def close(self):
+        if self.state is not None:
+            self.state.close()
+        self.session.close()
+
+
+def get_papers_from_arxiv_rss(
+    area: str, config: Optional[dict], fetcher: FeedFetcher = None
+) -> List[Paper]:
+    # get the feed from http://export.arxiv.org/rss/, only downloading it if it changed since the last run
+    if fetcher is None:
+        fetcher = FeedFetcher()
+    status, chunks = fetcher.fetch(area)
+    if status != 200:
+        if (
+            status == 304
+            and (config is not None)
+            and config["OUTPUT"].getboolean("debug_messages")
+        ):
+            print("No new papers since the last fetch for " + area)
+        # if there are no new papers, or the feed could not be fetched, return an empty list
         return [], None, None
+    if (config is not None) and config["PIPELINE"]["rss_parser"] == "feedparser":
+        return parse_feed_with_feedparser(b"".join(chunks), area, config)
+    # imported here since rss_parser needs the Paper class from this module
+    from rss_parser import parse_feed
+
+    force_primary = (config is not None) and config["FILTERING"].getboolean(
+        "force_primary"
+    )
+    return parse_feed(chunks, area, force_primary)
+
+
+def iter_papers_from_arxiv_rss(
+    area: str, config: Optional[dict], fetcher: FeedFetcher = None
+) -> Iterator[Paper]:
+    # like get_papers_from_arxiv_rss, but parses the feed as it downloads and yields each paper as soon as it is read
+    if (config is not None) and config["PIPELINE"]["rss_parser"] == "feedparser":
+        # feedparser needs the whole feed
+        yield from get_papers_from_arxiv_rss(area, config, fetcher)[0]
+        return
+    if fetcher is None:
+        fetcher = FeedFetcher()
+    status, chunks = fetcher.fetch(area)
+    if status != 200:
+        if (
+            status == 304
+            and (config is not None)
+            and config["OUTPUT"].getboolean("debug_messages")
+        ):
+            print("No new papers since the last fetch for " + area)
+        return
+    from rss_parser import FeedReader
+
+    force_primary = (config is not None) and config["FILTERING"].getboolean(
+        "force_primary"
+    )
+    reader = FeedReader(chunks, area, force_primary)
+    yield from reader
+    if reader.num_entries == 0:
+        print("No entries found for " + area)
+
+
+def parse_feed_with_feedparser(content: bytes, area: str, config: Optional[dict]):
+    # the original feedparser based parser, kept as a reference for the streaming one in rss_parser.py
+    feed = feedparser.parse(content)
     # get the list of entries
     entries = feed.entries
     if len(feed.entries) == 0:
@@ -130,14 +324,17 @@ def merge_paper_list(paper_list, api_paper_list):
     return merged_paper_list
 
 
-def get_papers_from_arxiv_rss_api(area: str, config: Optional[dict]) -> List[Paper]:
-    paper_list, timestamp, last_id = get_papers_from_arxiv_rss(area, config)
+def get_papers_from_arxiv_rss_api(
+    area: str, config: Optional[dict], fetcher: FeedFetcher = None
+) -> Iterator[Paper]:
+    # yields the papers of the feed while it downloads
+    yield from iter_papers_from_arxiv_rss(area, config, fetcher)
+    # paper_list, timestamp, last_id = get_papers_from_arxiv_rss(area, config, fetcher)
     # if timestamp is None:
     #    return []
     # api_paper_list = get_papers_from_arxiv_api(area, timestamp, last_id)
     # merged_paper_list = merge_paper_list(paper_list, api_paper_list)
     # return merged_paper_list
-    return paper_list
 
 
 if __name__ == "__main__":
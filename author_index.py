@@ -0,0 +1,56 @@
+"""
+Precomputed lookups over the semantic scholar author data, so that the author and h-index filters do a couple of
+dict/set operations per paper instead of scanning every alias of every author.
+"""
+
+from typing import Dict, Iterable, List
+
+from arxiv_scraper import Paper
+
+
+class AuthorIndex:
+    def __init__(self, author_targets: Iterable[str] = ()):
+        """
+        :param author_targets: semantic scholar ids of the authors we follow
+        """
+        self.author_targets = set(author_targets)
+        # name -> max hIndex over all aliases of that name
+        self.max_hindex: Dict[str, float] = {}
+        # name -> semantic scholar ids of all aliases of that name
+        self.author_ids: Dict[str, tuple] = {}
+        # names with at least one alias we follow
+        self.watched_names = set()
+
+    @classmethod
+    def build(cls, all_authors: Dict[str, List[dict]], author_targets=()):
+        index = cls(author_targets)
+        index.update(all_authors)
+        return index
+
+    def update(self, all_authors: Dict[str, List[dict]]):
+        # adds (or refreshes) the given names, so the index can grow as authors get resolved.
+        # built with comprehensions, since this loops over every alias once per run
+        author_ids = {
+            name: tuple([alias["authorId"] for alias in aliases])
+            for name, aliases in all_authors.items()
+        }
+        self.author_ids.update(author_ids)
+        self.max_hindex.update(
+            {
+                name: max([alias["hIndex"] or 0 for alias in aliases], default=0)
+                for name, aliases in all_authors.items()
+            }
+        )
+        self.watched_names.difference_update(author_ids)
+        self.watched_names.update(
+            name
+            for name, ids in author_ids.items()
+            if not self.author_targets.isdisjoint(ids)
+        )
+
+    def has_watched_author(self, paper: Paper) -> bool:
+        return not self.watched_names.isdisjoint(paper.authors)
+
+    def names_with_hindex(self, hcutoff: float) -> set:
+        # names with at least one alias at or above hcutoff
+        return {name for name, hindex in self.max_hindex.items() if hindex >= hcutoff}
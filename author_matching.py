@@ -0,0 +1,117 @@
+"""
+Links arxiv author strings to the authors we follow in configs/authors.txt, tolerating diacritics, punctuation,
+middle names, initials and small typos. Names are only compared against watched authors that share a blocking key
+(start of the normalized surname plus first initial), so matching stays linear in the number of names.
+"""
+
+import re
+import unicodedata
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+import Levenshtein
+
+NON_LETTERS = re.compile(r"[^a-z0-9 ]+")
+# name suffixes that would otherwise be taken for the surname
+SUFFIXES = frozenset(["jr", "sr", "ii", "iii", "iv"])
+
+
+def normalize_name(name: str) -> List[str]:
+    # "José-Luis  Pérez Jr." -> ["jose", "luis", "perez"]
+    decomposed = unicodedata.normalize("NFKD", name)
+    ascii_name = "".join(c for c in decomposed if not unicodedata.combining(c))
+    ascii_name = NON_LETTERS.sub(" ", ascii_name.lower().replace("'", ""))
+    tokens = ascii_name.split()
+    while len(tokens) > 2 and tokens[-1] in SUFFIXES:
+        tokens.pop()
+    return tokens
+
+
+def blocking_key(tokens: List[str]) -> Tuple[str, str]:
+    # names can only match if the first letters of the surname and the first initial agree
+    return tokens[-1][:3], tokens[0][0]
+
+
+def short_form(tokens: List[str], initial_only: bool) -> str:
+    # first given name and surname, middle names dropped since they are often left out
+    first = tokens[0][0] if initial_only else tokens[0]
+    return first + " " + tokens[-1]
+
+
+def is_initial_only(tokens_a: List[str], tokens_b: List[str]) -> bool:
+    # one of the names has a bare initial, so only the letter of the first names can be compared
+    return len(tokens_a[0]) == 1 or len(tokens_b[0]) == 1
+
+
+def name_similarity(tokens_a: List[str], tokens_b: List[str]) -> float:
+    # levenshtein ratio of the two names without middle names. a bare initial only has to agree with the other first name
+    initial_only = is_initial_only(tokens_a, tokens_b)
+    return Levenshtein.ratio(
+        short_form(tokens_a, initial_only), short_form(tokens_b, initial_only)
+    )
+
+
+class AuthorMatcher:
+    def __init__(
+        self, author_names: List[str], author_ids: List[str], threshold: float
+    ):
+        """
+        :param author_names: names of the watched authors, as in configs/authors.txt
+        :param author_ids: semantic scholar ids of the watched authors, same order as author_names
+        :param threshold: min similarity in [0, 1] for a name to count as a watched author
+        """
+        self.threshold = threshold
+        self.blocks: Dict[Tuple[str, str], list] = defaultdict(list)
+        for name, author_id in zip(author_names, author_ids):
+            tokens = normalize_name(name)
+            if len(tokens) < 2:
+                continue
+            self.blocks[blocking_key(tokens)].append((tokens, author_id, name))
+
+    def match(self, name: str) -> List[dict]:
+        """
+        :return: the watched authors the name matches, as semantic scholar style author dicts with the similarity.
+        initial_only marks matches that rest on a bare initial, which anyone sharing the initial and surname
+        matches too, so they need confirming by a semantic scholar lookup
+        """
+        tokens = normalize_name(name)
+        if len(tokens) < 2:
+            return []
+        candidates = self.blocks.get(blocking_key(tokens), [])
+        # some bylines put the surname first
+        reversed_tokens = tokens[1:] + tokens[:1]
+        reversed_candidates = self.blocks.get(blocking_key(reversed_tokens), [])
+        matches = {}
+        for query, block in [
+            (tokens, candidates),
+            (reversed_tokens, reversed_candidates),
+        ]:
+            for watched_tokens, author_id, watched_name in block:
+                similarity = name_similarity(query, watched_tokens)
+                if similarity >= self.threshold and similarity > matches.get(
+                    author_id, {}
+                ).get("similarity", 0):
+                    matches[author_id] = {
+                        "authorId": author_id,
+                        "name": watched_name,
+                        "similarity": similarity,
+                        "initial_only": is_initial_only(query, watched_tokens),
+                    }
+        return list(matches.values())
+
+    def match_all(self, names) -> Dict[str, List[dict]]:
+        # name -> matching watched authors, for the names that match any
+        matches = {}
+        for name in names:
+            matched = self.match(name)
+            if matched:
+                matches[name] = matched
+        return matches
+
+
+def load_author_matcher(config, author_names: List[str], author_ids: List[str]):
+    if not config["FILTERING"].getboolean("fuzzy_author_match"):
+        return None
+    return AuthorMatcher(
+        author_names, author_ids, float(config["FILTERING"]["fuzzy_author_threshold"])
+    )
@@ -0,0 +1,269 @@
+"""
+Backfills a date range from the arxiv api and runs it through the normal filter pipeline, e.g. to rebuild
+past months after changing paper_topics.txt.
+The range is split into shards of a day (or less) per category. Shards are fetched in parallel while a shared
+rate limiter keeps the total request rate within arxiv's api terms, and every finished shard is checkpointed
+to disk so an interrupted backfill picks up where it left off.
+
+python backfill.py --start 2024-01-01 --end 2024-03-31 [--categories cs.CL,cs.LG]
+"""
+
+import argparse
+import configparser
+import io
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from typing import List, Tuple
+from xml.etree import ElementTree
+
+from tqdm import tqdm
+
+from arxiv_scraper import Paper
+from author_matching import load_author_matcher
+from filter_papers import filter_by_author, filter_by_gpt
+from llm_backends import make_client
+from main import (
+    argsort,
+    make_session,
+    open_author_cache,
+    parse_authors,
+    resolve_authors,
+)
+from parse_json_to_md import write_md
+from rate_limit import TokenBucket, request_with_backoff
+
+API_URL = "http://export.arxiv.org/api/query"
+ATOM_NS = "{http://www.w3.org/2005/Atom}"
+ARXIV_NS = "{http://arxiv.org/schemas/atom}"
+OPENSEARCH_NS = "{http://a9.com/-/spec/opensearch/1.1/}"
+VERSION_SUFFIX = re.compile(r"v[0-9]+$")
+WHITESPACE = re.compile(r"\s+")
+SHARD_FORMAT = "%Y%m%d%H%M"
+
+
+def make_shards(
+    start: datetime, end: datetime, shard_hours: int
+) -> List[Tuple[datetime, datetime]]:
+    # splits [start, end) into consecutive windows of shard_hours
+    shards = []
+    shard_start = start
+    while shard_start < end:
+        shard_end = min(shard_start + timedelta(hours=shard_hours), end)
+        shards.append((shard_start, shard_end))
+        shard_start = shard_end
+    return shards
+
+
+def build_query(area: str, shard: Tuple[datetime, datetime]) -> str:
+    # the submittedDate range is inclusive on both ends, so stop a minute before the next shard starts
+    return "cat:%s AND submittedDate:[%s TO %s]" % (
+        area,
+        shard[0].strftime(SHARD_FORMAT),
+        (shard[1] - timedelta(minutes=1)).strftime(SHARD_FORMAT),
+    )
+
+
+def parse_api_feed(content: bytes, area: str, force_primary: bool):
+    # parses one page of arxiv api results, returns the papers on it and the total number of results
+    root = ElementTree.parse(io.BytesIO(content)).getroot()
+    total_results = int(root.findtext(OPENSEARCH_NS + "totalResults", "0"))
+    paper_list = []
+    for entry in root.iter(ATOM_NS + "entry"):
+        entry_id = entry.findtext(ATOM_NS + "id", "")
+        # skip the error entries the api returns for malformed queries
+        if "/abs/" not in entry_id:
+            continue
+        primary = entry.find(ARXIV_NS + "primary_category")
+        if force_primary and (primary is None or primary.get("term") != area):
+            continue
+        paper_list.append(
+            Paper(
+                authors=[
+                    WHITESPACE.sub(" ", author.findtext(ATOM_NS + "name", "")).strip()
+                    for author in entry.iter(ATOM_NS + "author")
+                ],
+                title=WHITESPACE.sub(
+                    " ", entry.findtext(ATOM_NS + "title", "")
+                ).strip(),
+                abstract=WHITESPACE.sub(
+                    " ", entry.findtext(ATOM_NS + "summary", "")
+                ).strip(),
+                arxiv_id=VERSION_SUFFIX.sub("", entry_id.split("/abs/")[-1]),
+            )
+        )
+    return paper_list, total_results
+
+
+def fetch_shard(
+    session, limiter: TokenBucket, area: str, shard, page_size: int, force_primary
+) -> List[Paper]:
+    paper_list = []
+    start = 0
+    while True:
+        response = request_with_backoff(
+            session,
+            "GET",
+            API_URL,
+            limiter=limiter,
+            params={
+                "search_query": build_query(area, shard),
+                "start": start,
+                "max_results": page_size,
+                "sortBy": "submittedDate",
+                "sortOrder": "ascending",
+            },
+            timeout=120,
+        )
+        page, total_results = parse_api_feed(response.content, area, force_primary)
+        paper_list.extend(page)
+        start += page_size
+        if start >= total_results:
+            return paper_list
+
+
+def shard_path(checkpoint_dir: str, area: str, shard) -> str:
+    return os.path.join(
+        checkpoint_dir,
+        "%s_%s_%s.json"
+        % (area, shard[0].strftime(SHARD_FORMAT), shard[1].strftime(SHARD_FORMAT)),
+    )
+
+
+def load_shard(path: str):
+    # returns the checkpointed papers of a shard or None if it has not been fetched yet
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return [Paper(**paper) for paper in json.load(f)]
+
+
+def save_shard(path: str, paper_list: List[Paper]):
+    # write to a temporary file first so that a crash never leaves a half written checkpoint behind
+    with open(path + ".tmp", "w") as f:
+        json.dump([paper.to_dict() for paper in paper_list], f)
+    os.replace(path + ".tmp", path)
+
+
+def get_papers_from_arxiv_backfill(
+    config, areas: List[str], start: datetime, end: datetime
+) -> List[Paper]:
+    """
+    :param areas: arxiv categories to fetch
+    :param start: start of the range, inclusive
+    :param end: end of the range, exclusive
+    :return: the papers submitted in the range, deduplicated across categories and sorted by arxiv id
+    """
+    checkpoint_dir = config["BACKFILL"]["checkpoint_dir"]
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    page_size = int(config["BACKFILL"]["page_size"])
+    max_in_flight = int(config["BACKFILL"]["max_in_flight"])
+    force_primary = config["FILTERING"].getboolean("force_primary")
+    # one limiter for all workers, the api terms ask for no more than one request every three seconds
+    limiter = TokenBucket(float(config["BACKFILL"]["requests_per_second"]), capacity=1)
+    session = make_session(max_in_flight)
+
+    jobs = [
+        (area, shard)
+        for area in areas
+        for shard in make_shards(start, end, int(config["BACKFILL"]["shard_hours"]))
+    ]
+    results = {}
+    for area, shard in jobs:
+        paper_list = load_shard(shard_path(checkpoint_dir, area, shard))
+        if paper_list is not None:
+            results[(area, shard)] = paper_list
+    if config["OUTPUT"].getboolean("debug_messages"):
+        print(
+            "Backfilling %d shards, %d already checkpointed" % (len(jobs), len(results))
+        )
+
+    def fetch_job(job):
+        area, shard = job
+        paper_list = fetch_shard(
+            session, limiter, area, shard, page_size, force_primary
+        )
+        save_shard(shard_path(checkpoint_dir, area, shard), paper_list)
+        return paper_list
+
+    remaining = [job for job in jobs if job not in results]
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        futures = {executor.submit(fetch_job, job): job for job in remaining}
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            results[futures[future]] = future.result()
+
+    papers = {}
+    for job in jobs:
+        for paper in results[job]:
+            papers.setdefault(paper.arxiv_id, paper)
+    return [papers[arxiv_id] for arxiv_id in sorted(papers)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--start", required=True, help="first day, YYYY-MM-DD")
+    parser.add_argument("--end", required=True, help="last day, YYYY-MM-DD")
+    parser.add_argument(
+        "--categories", help="comma separated, defaults to arxiv_category"
+    )
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read("configs/config.ini")
+    start = datetime.strptime(args.start, "%Y-%m-%d")
+    end = datetime.strptime(args.end, "%Y-%m-%d") + timedelta(days=1)
+    categories = args.categories or config["FILTERING"]["arxiv_category"]
+    areas = [area.strip() for area in categories.split(",")]
+
+    S2_API_KEY = os.environ.get("S2_KEY")
+    # created up front so that a missing OAI_KEY fails before anything is fetched. clients of the
+    # other backends are created from their [LLM <name>] sections when scoring starts
+    openai_client = None
+    if "openai" in [
+        config["LLM"]["scoring_backend"],
+        config["LLM"]["title_filter_backend"],
+    ]:
+        openai_client = make_client(config, "openai")
+    with io.open("configs/authors.txt", "r") as fopen:
+        author_names, author_ids = parse_authors(fopen.readlines())
+    author_id_set = set(author_ids)
+    matcher = load_author_matcher(config, author_names, author_ids)
+
+    papers = get_papers_from_arxiv_backfill(config, areas, start, end)
+    print("Number of papers:" + str(len(papers)))
+    author_cache = open_author_cache(config)
+    all_authors = resolve_authors(
+        papers, S2_API_KEY, config, cache=author_cache, matcher=matcher
+    )
+    if author_cache is not None:
+        author_cache.close()
+    selected_papers, all_papers, sort_dict = filter_by_author(
+        all_authors, papers, author_id_set, config
+    )
+    filter_by_gpt(
+        all_authors,
+        papers,
+        config,
+        openai_client,
+        all_papers,
+        selected_papers,
+        sort_dict,
+    )
+
+    # sort the papers by relevance and novelty
+    keys = list(sort_dict.keys())
+    values = list(sort_dict.values())
+    sorted_keys = [keys[idx] for idx in argsort(values)[::-1]]
+    selected_papers = {key: selected_papers[key] for key in sorted_keys}
+
+    prefix = config["OUTPUT"]["output_path"] + "backfill_%s_%s_" % (
+        args.start,
+        args.end,
+    )
+    with open(prefix + "output.json", "w") as outfile:
+        json.dump(selected_papers, outfile, indent=4)
+    with open(prefix + "output.md", "w") as f:
+        write_md(selected_papers, f)
+    print("Wrote " + prefix + "output.json and " + prefix + "output.md")
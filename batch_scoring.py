@@ -0,0 +1,230 @@
+"""
+Scores prompts through the OpenAI Batch API instead of one synchronous request each. The daily job does not need
+the answers right away, and batch requests are billed at a discount and don't count against the per minute
+rate limits.
+Every step (uploaded input file, created batch, downloaded output) is checkpointed to a state file keyed by the
+requests, so a restarted run picks up the batch it already submitted instead of paying for it twice.
+A batch that does not finish within batch_max_wait_hours is cancelled, and its prompts are scored synchronously.
+"""
+
+import hashlib
+import json
+import os
+import time
+from typing import List
+
+import httpx
+from openai import OpenAI
+from openai.types.chat import ChatCompletion
+
+from completion_cache import CompletionCache
+from llm_backends import LLMBackend, cached_tokens
+from telemetry import metrics
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+# batch statuses after which nothing changes anymore
+FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+# statuses after which we stop waiting for the batch
+DONE_STATUSES = FINAL_STATUSES | {"cancelling"}
+
+
+class BatchJob:
+    def __init__(self, openai_client: OpenAI, state_dir: str, requests_jsonl: bytes):
+        """
+        :param state_dir: directory for the checkpoints
+        :param requests_jsonl: the batch input file, the job is identified by its hash
+        """
+        self.openai_client = openai_client
+        self.requests_jsonl = requests_jsonl
+        os.makedirs(state_dir, exist_ok=True)
+        job_key = hashlib.sha256(requests_jsonl).hexdigest()[:16]
+        self.state_path = os.path.join(state_dir, job_key + ".json")
+        self.output_path = os.path.join(state_dir, job_key + ".output.jsonl")
+        self.state = {}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, "r") as f:
+                self.state = json.load(f)
+
+    def save(self):
+        with open(self.state_path + ".tmp", "w") as f:
+            json.dump(self.state, f)
+        os.replace(self.state_path + ".tmp", self.state_path)
+
+    def submit(self):
+        # uploads the requests and creates the batch, skipping whatever an earlier run already did
+        if "input_file_id" not in self.state:
+            input_file = self.openai_client.files.create(
+                file=("requests.jsonl", self.requests_jsonl), purpose="batch"
+            )
+            self.state["input_file_id"] = input_file.id
+            self.save()
+        if "batch_id" not in self.state:
+            # the installed client has no batches resource, so use the generic request methods
+            batch = self.openai_client.post(
+                "/batches",
+                body={
+                    "input_file_id": self.state["input_file_id"],
+                    "endpoint": BATCH_ENDPOINT,
+                    "completion_window": "24h",
+                },
+                cast_to=httpx.Response,
+            ).json()
+            self.state["batch_id"] = batch["id"]
+            self.state["status"] = batch["status"]
+            self.save()
+
+    def wait(self, poll_seconds: float, max_wait_seconds: float, debug: bool = False):
+        # polls the batch until it reaches a final status. if we run out of time the batch gets cancelled, so we
+        # don't pay for answers nobody reads, and its requests are left without results
+        start = time.monotonic()
+        while self.state.get("status") not in DONE_STATUSES:
+            batch = self.openai_client.get(
+                "/batches/" + self.state["batch_id"], cast_to=httpx.Response
+            ).json()
+            self.state["status"] = batch["status"]
+            self.state["output_file_id"] = batch.get("output_file_id")
+            self.save()
+            if debug:
+                print(
+                    "Batch "
+                    + self.state["batch_id"]
+                    + " is "
+                    + batch["status"]
+                    + " "
+                    + str(batch.get("request_counts"))
+                )
+            if batch["status"] in DONE_STATUSES:
+                break
+            if time.monotonic() - start > max_wait_seconds:
+                self.cancel()
+                if debug:
+                    print(
+                        "Batch "
+                        + self.state["batch_id"]
+                        + " did not finish in time, cancelled it"
+                    )
+                break
+            time.sleep(poll_seconds)
+
+    def cancel(self):
+        batch = self.openai_client.post(
+            "/batches/" + self.state["batch_id"] + "/cancel", cast_to=httpx.Response
+        ).json()
+        self.state["status"] = batch["status"]
+        self.save()
+        metrics.count("batch_jobs_cancelled")
+
+    def results(self) -> dict:
+        # custom_id -> ChatCompletion for the requests that succeeded. the output is kept on disk once downloaded
+        if not os.path.exists(self.output_path):
+            content = b""
+            if self.state.get("output_file_id") is not None:
+                content = self.openai_client.files.content(
+                    self.state["output_file_id"]
+                ).content
+            with open(self.output_path + ".tmp", "wb") as f:
+                f.write(content)
+            os.replace(self.output_path + ".tmp", self.output_path)
+        completions = {}
+        with open(self.output_path, "rb") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                response = result.get("response") or {}
+                if response.get("status_code") == 200:
+                    completions[result["custom_id"]] = ChatCompletion.model_validate(
+                        response["body"]
+                    )
+        return completions
+
+
+@metrics.span("batch_job")
+def run_batch_job(
+    prompts: List[str],
+    backend: LLMBackend,
+    config,
+    cache: CompletionCache = None,
+    temperature: float = 0.0,
+    seed: int = 0,
+    n: int = 1,
+    response_format: dict = None,
+):
+    """
+    Gets completions for all prompts with a single batch job. Prompts in the completion cache are not submitted.
+    :return: a ChatCompletion (or None if its request failed or the job was cancelled) and its cost per prompt
+    """
+    model = backend.model
+    debug = config["OUTPUT"].getboolean("debug_messages")
+    completions = [None] * len(prompts)
+    costs = [0.0] * len(prompts)
+    keys = [
+        CompletionCache.make_key(
+            model, temperature, seed, prompt, n, response_format, backend.base_url
+        )
+        for prompt in prompts
+    ]
+    request_lines = []
+    for i, (prompt, key) in enumerate(zip(prompts, keys)):
+        if cache is not None:
+            completions[i] = cache.get(key)
+            if completions[i] is not None:
+                cache.record_saved(backend.price(completions[i].usage))
+                metrics.record_llm("scoring", completions[i].usage, 0.0, cache_hit=True)
+                continue
+        body = {
+            "model": model,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": temperature,
+            "seed": seed,
+        }
+        if n != 1:
+            body["n"] = n
+        if response_format is not None:
+            body["response_format"] = response_format
+        request_lines.append(
+            json.dumps(
+                {
+                    "custom_id": "request-" + str(i),
+                    "method": "POST",
+                    "url": BATCH_ENDPOINT,
+                    "body": body,
+                }
+            )
+        )
+    if len(request_lines) == 0:
+        return completions, costs
+
+    job = BatchJob(
+        backend.client,
+        os.path.join(config["CACHE"]["cache_dir"], "batch_jobs"),
+        ("\n".join(request_lines) + "\n").encode("utf-8"),
+    )
+    job.submit()
+    if debug:
+        print(
+            "Submitted "
+            + str(len(request_lines))
+            + " requests as batch "
+            + job.state["batch_id"]
+        )
+    job.wait(
+        float(config["SELECTION"]["batch_poll_seconds"]),
+        float(config["SELECTION"]["batch_max_wait_hours"]) * 60 * 60,
+        debug,
+    )
+    results = job.results()
+    price_factor = float(config["SELECTION"]["batch_price_factor"])
+    for i, key in enumerate(keys):
+        completion = results.get("request-" + str(i))
+        if completion is None:
+            continue
+        completions[i] = completion
+        backend.record_usage(completion.usage)
+        costs[i] = backend.price(completion.usage) * price_factor
+        metrics.record_llm(
+            "scoring", completion.usage, costs[i], cached_tokens(completion.usage)
+        )
+        if cache is not None:
+            cache.set(key, completion)
+    return completions, costs
@@ -0,0 +1,156 @@
+"""
+Compares the author and h-index filters using an AuthorIndex against the original nested alias scans
+on a synthetic workload (by default 50k papers written by 200k distinct author names).
+Run from the repo root: python benchmarks/author_filter_benchmark.py [--papers 50000] [--authors 200000]
+"""
+
+import argparse
+import configparser
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from arxiv_scraper import Paper  # noqa: E402
+from author_index import AuthorIndex  # noqa: E402
+from filter_papers import filter_by_author, filter_papers_by_hindex  # noqa: E402
+
+
+def legacy_filter_by_author(all_authors, papers, author_targets, config):
+    # the scan filter_by_author did before the index
+    selected_papers = {}
+    all_papers = {}
+    sort_dict = {}
+    for paper in papers:
+        all_papers[paper.arxiv_id] = paper
+        for author in paper.authors:
+            if author in all_authors:
+                for alias in all_authors[author]:
+                    if alias["authorId"] in author_targets:
+                        selected_papers[paper.arxiv_id] = {
+                            **paper.to_dict(),
+                            **{"COMMENT": "Author match"},
+                        }
+                        sort_dict[paper.arxiv_id] = float(
+                            config["SELECTION"]["author_match_score"]
+                        )
+                        break
+    return selected_papers, all_papers, sort_dict
+
+
+def legacy_filter_papers_by_hindex(all_authors, papers, config):
+    # the scan filter_papers_by_hindex did before the index
+    paper_list = []
+    for paper in papers:
+        max_h = 0
+        for author in paper.authors:
+            if author in all_authors:
+                max_h = max(
+                    max_h, max([alias["hIndex"] for alias in all_authors[author]])
+                )
+        if max_h >= float(config["FILTERING"]["hcutoff"]):
+            paper_list.append(paper)
+    return paper_list
+
+
+def make_workload(num_papers: int, num_authors: int, num_targets: int, seed: int = 0):
+    # every name has 1-3 semantic scholar aliases, and papers draw their authors from a long tailed distribution
+    rng = random.Random(seed)
+    names = ["Author %d" % i for i in range(num_authors)]
+    all_authors = {}
+    next_id = 0
+    for name in names:
+        aliases = []
+        for _ in range(rng.choice([1, 1, 1, 2, 3])):
+            aliases.append(
+                {
+                    "authorId": str(next_id),
+                    "name": name,
+                    "hIndex": int(rng.expovariate(1 / 12)),
+                }
+            )
+            next_id += 1
+        all_authors[name] = aliases
+    author_targets = {str(rng.randrange(next_id)) for _ in range(num_targets)}
+    papers = [
+        Paper(
+            authors=[
+                names[min(int(rng.paretovariate(0.6)), num_authors) - 1]
+                if rng.random() < 0.5
+                else rng.choice(names)
+                for _ in range(rng.randint(1, 12))
+            ],
+            title="title %d" % i,
+            abstract="abstract",
+            arxiv_id="2401.%05d" % i,
+        )
+        for i in range(num_papers)
+    ]
+    return papers, all_authors, author_targets
+
+
+def best_time(fn, repeats: int):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--papers", type=int, default=50000)
+    parser.add_argument("--authors", type=int, default=200000)
+    parser.add_argument("--targets", type=int, default=500)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read("configs/config.ini")
+    papers, all_authors, author_targets = make_workload(
+        args.papers, args.authors, args.targets
+    )
+    print(
+        "%d papers, %d author names, %d followed ids"
+        % (len(papers), len(all_authors), len(author_targets))
+    )
+
+    legacy_selected, legacy_author_time = best_time(
+        lambda: legacy_filter_by_author(all_authors, papers, author_targets, config),
+        args.repeats,
+    )
+    legacy_hindex, legacy_hindex_time = best_time(
+        lambda: legacy_filter_papers_by_hindex(all_authors, papers, config),
+        args.repeats,
+    )
+    index, build_time = best_time(
+        lambda: AuthorIndex.build(all_authors, author_targets), args.repeats
+    )
+    selected, author_time = best_time(
+        lambda: filter_by_author(all_authors, papers, author_targets, config, index),
+        args.repeats,
+    )
+    hindex, hindex_time = best_time(
+        lambda: filter_papers_by_hindex(all_authors, papers, config, index),
+        args.repeats,
+    )
+
+    print("building the index: %.1f ms" % (build_time * 1000))
+    print(
+        "filter_by_author: %.1f ms -> %.1f ms, same result: %s"
+        % (legacy_author_time * 1000, author_time * 1000, legacy_selected == selected)
+    )
+    print(
+        "filter_papers_by_hindex: %.1f ms -> %.1f ms, same result: %s"
+        % (legacy_hindex_time * 1000, hindex_time * 1000, legacy_hindex == hindex)
+    )
+    print(
+        "both filters including the index build: %.1f ms -> %.1f ms"
+        % (
+            (legacy_author_time + legacy_hindex_time) * 1000,
+            (build_time + author_time + hindex_time) * 1000,
+        )
+    )
@@ -0,0 +1,272 @@
+"""
+A local stand-in for the parts of the OpenAI API the pipeline uses: chat completions, file upload/download and
+the Batch API. Scoring prompts get deterministic scores derived from the arxiv ids in the prompt, and title filter
+prompts get an empty list, so runs against the stub are reproducible and cost nothing.
+Batches finish on the second poll, so the polling and resume paths get exercised too. JSON mode, structured outputs
+and streaming are supported, and --malformed-every breaks some score records to exercise the re-requests.
+
+python benchmarks/openai_stub_server.py --port 8766
+OPENAI_BASE_URL=http://localhost:8766/v1 OAI_KEY=stub python main.py
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import re
+import time
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ARXIV_ID = re.compile(r"ArXiv ID: (\S+)")
+TITLE_FILTER_MARKER = "formatted as a list of arxiv ids"
+
+# every this many score records of multi paper prompts are malformed, 0 for never
+malformed_every = 0
+ids = itertools.count()
+# recent prompts, to report prompt caching like OpenAI does: in steps of 128 tokens once 1024 tokens match
+recent_prompts = []
+files = {}
+batches = {}
+
+
+def new_id(prefix: str) -> str:
+    return prefix + "-" + str(next(ids))
+
+
+def score(arxiv_id: str, salt: str) -> int:
+    # deterministic score in 1-10
+    return int(hashlib.sha256((salt + arxiv_id).encode()).hexdigest(), 16) % 10 + 1
+
+
+def common_prefix_length(a: str, b: str) -> int:
+    # binary search over slice comparisons, which is much faster than comparing character by character
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def cached_tokens(prompt: str) -> int:
+    # tokens are approximated as 4 characters
+    matched = max(
+        [common_prefix_length(prompt, other) for other in recent_prompts],
+        default=0,
+    )
+    recent_prompts.append(prompt)
+    del recent_prompts[:-64]
+    tokens = matched // 4
+    return tokens // 128 * 128 if tokens >= 1024 else 0
+
+
+def complete(body: dict) -> dict:
+    # a chat completion answering the prompt in the request body
+    prompt = body["messages"][-1]["content"]
+    arxiv_ids = ARXIV_ID.findall(prompt)
+    choices = []
+    for i in range(body.get("n", 1)):
+        if TITLE_FILTER_MARKER in prompt:
+            content = "[]"
+        else:
+            # seed and choice index change the scores a little, like sampling would
+            salt = str(body.get("seed", 0)) + str(i) if body.get("temperature") else ""
+            records = [
+                json.dumps(
+                    {
+                        "ARXIVID": arxiv_id,
+                        "COMMENT": "stub",
+                        "RELEVANCE": score(arxiv_id, "r" + salt),
+                        "NOVELTY": score(arxiv_id, "n" + salt),
+                    }
+                )
+                for arxiv_id in arxiv_ids
+            ]
+            if malformed_every > 0 and len(records) > 1:
+                for j in range(malformed_every - 1, len(records), malformed_every):
+                    records[j] = records[j].replace('"RELEVANCE"', "RELEVANCE")
+            if body.get("response_format", {}).get("type") in [
+                "json_object",
+                "json_schema",
+            ]:
+                content = '{"papers": [' + ", ".join(records) + "]}"
+            else:
+                content = "\n".join(records)
+        choices.append(
+            {
+                "index": i,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }
+        )
+    prompt_tokens = len(prompt) // 4
+    completion_tokens = sum(len(c["message"]["content"]) // 4 for c in choices)
+    return {
+        "id": new_id("chatcmpl"),
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body["model"],
+        "choices": choices,
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens(prompt)},
+        },
+    }
+
+
+def run_batch(batch: dict):
+    # answers every request of the batch input file and stores the output file
+    output_lines = []
+    for line in files[batch["input_file_id"]].splitlines():
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        output_lines.append(
+            json.dumps(
+                {
+                    "id": new_id("batch_req"),
+                    "custom_id": request["custom_id"],
+                    "response": {"status_code": 200, "body": complete(request["body"])},
+                    "error": None,
+                }
+            )
+        )
+    output_file_id = new_id("file")
+    files[output_file_id] = ("\n".join(output_lines) + "\n").encode()
+    batch["output_file_id"] = output_file_id
+    batch["request_counts"] = {
+        "total": len(output_lines),
+        "completed": len(output_lines),
+        "failed": 0,
+    }
+    batch["status"] = "completed"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def send_json(self, payload: dict, status: int = 200):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_stream(self, completion: dict):
+        # sends the completion as server-sent chunks of a few characters each
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for choice in completion["choices"]:
+            content = choice["message"]["content"]
+            pieces = [content[i : i + 16] for i in range(0, len(content), 16)]
+            for piece in pieces + [None]:
+                chunk = {
+                    "id": completion["id"],
+                    "object": "chat.completion.chunk",
+                    "created": completion["created"],
+                    "model": completion["model"],
+                    "choices": [
+                        {
+                            "index": choice["index"],
+                            "delta": {"content": piece} if piece is not None else {},
+                            "finish_reason": None if piece is not None else "stop",
+                        }
+                    ],
+                }
+                self.wfile.write(b"data: " + json.dumps(chunk).encode() + b"\n\n")
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_POST(self):
+        body = self.read_body()
+        if self.path == "/v1/chat/completions":
+            request = json.loads(body)
+            if request.get("stream"):
+                self.send_stream(complete(request))
+            else:
+                self.send_json(complete(request))
+        elif self.path == "/v1/files":
+            message = BytesParser(policy=policy.default).parsebytes(
+                b"Content-Type: "
+                + self.headers["Content-Type"].encode()
+                + b"\r\n\r\n"
+                + body
+            )
+            file_id = new_id("file")
+            for part in message.iter_parts():
+                if part.get_param("name", header="content-disposition") == "file":
+                    files[file_id] = part.get_payload(decode=True)
+            self.send_json(
+                {
+                    "id": file_id,
+                    "object": "file",
+                    "bytes": len(files[file_id]),
+                    "created_at": int(time.time()),
+                    "filename": "requests.jsonl",
+                    "purpose": "batch",
+                    "status": "processed",
+                }
+            )
+        elif self.path == "/v1/batches":
+            request = json.loads(body)
+            batch = {
+                "id": new_id("batch"),
+                "object": "batch",
+                "input_file_id": request["input_file_id"],
+                "endpoint": request["endpoint"],
+                "status": "validating",
+                "output_file_id": None,
+                "polls": 0,
+            }
+            batches[batch["id"]] = batch
+            self.send_json(batch)
+        elif re.fullmatch(r"/v1/batches/([^/]+)/cancel", self.path):
+            batch = batches[self.path.split("/")[-2]]
+            if batch["status"] not in ["completed", "failed", "expired", "cancelled"]:
+                batch["status"] = "cancelling"
+            self.send_json(batch)
+        else:
+            self.send_json({"error": {"message": "not found"}}, 404)
+
+    def do_GET(self):
+        match = re.fullmatch(r"/v1/batches/([^/]+)", self.path)
+        if match and match.group(1) in batches:
+            batch = batches[match.group(1)]
+            batch["polls"] += 1
+            if batch["polls"] == 1:
+                batch["status"] = "in_progress"
+            elif batch["status"] == "in_progress":
+                run_batch(batch)
+            self.send_json(batch)
+            return
+        match = re.fullmatch(r"/v1/files/([^/]+)/content", self.path)
+        if match and match.group(1) in files:
+            data = files[match.group(1)]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        self.send_json({"error": {"message": "not found"}}, 404)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--malformed-every", type=int, default=0)
+    args = parser.parse_args()
+    malformed_every = args.malformed_every
+    ThreadingHTTPServer(("localhost", args.port), StubHandler).serve_forever()
@@ -0,0 +1,126 @@
+"""
+Measures the memory held per paper by the slotted Paper with interned authors against the original plain dataclass
+on a synthetic corpus, and the time to turn papers into dicts with to_dict() against dataclasses.asdict.
+Run from the repo root: python benchmarks/paper_memory_benchmark.py [--papers 100000]
+"""
+
+import argparse
+import dataclasses
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from arxiv_scraper import Paper  # noqa: E402
+
+
+@dataclass
+class LegacyPaper:
+    # the paper class as it was before slots and interning
+    authors: List[str]
+    title: str
+    abstract: str
+    arxiv_id: str
+
+    def __hash__(self):
+        return hash(self.arxiv_id)
+
+
+def make_corpus(num_papers: int, seed: int = 0):
+    """
+    :return: raw field tuples. every author string is a fresh object, like the ones a parser decodes from a feed.
+    names are drawn from a pool with a long tail, so prolific authors show up on many papers.
+    """
+    rng = random.Random(seed)
+    words = [
+        "".join(
+            rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 10))
+        )
+        for _ in range(5000)
+    ]
+    names = [
+        rng.choice(words).capitalize() + " " + rng.choice(words).capitalize()
+        for _ in range(num_papers // 2)
+    ]
+    # titles and abstracts are slices of one long text, which keeps generating the corpus fast under tracemalloc
+    text = " ".join(rng.choices(words, k=100000))
+    corpus = []
+    for i in range(num_papers):
+        authors = [
+            (names[int(rng.paretovariate(1.2)) % len(names)] + " ")[:-1]
+            for _ in range(rng.randint(1, 10))
+        ]
+        start = rng.randrange(len(text) - 2000)
+        title = text[start : start + rng.randint(40, 120)]
+        abstract = text[start : start + rng.randint(700, 1800)]
+        corpus.append(
+            (authors, title, abstract, "%04d.%05d" % (2400 + i // 99999, i % 99999))
+        )
+    return corpus
+
+
+def measure(paper_class, num_papers: int):
+    # returns the papers and the bytes still allocated once the raw corpus they were built from is gone
+    gc.collect()
+    tracemalloc.start()
+    corpus = make_corpus(num_papers)
+    papers = [paper_class(*fields) for fields in corpus]
+    del corpus
+    gc.collect()
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return papers, allocated
+
+
+def text_bytes(papers) -> int:
+    # title, abstract and id strings, which are the same size in both representations
+    return sum(
+        sys.getsizeof(paper.title)
+        + sys.getsizeof(paper.abstract)
+        + sys.getsizeof(paper.arxiv_id)
+        for paper in papers
+    )
+
+
+def time_to_dict(papers, to_dict):
+    start = time.perf_counter()
+    for paper in papers:
+        to_dict(paper)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--papers", type=int, default=100000)
+    args = parser.parse_args()
+
+    legacy_papers, legacy_bytes = measure(LegacyPaper, args.papers)
+    papers, paper_bytes = measure(Paper, args.papers)
+    legacy_text_bytes = text_bytes(legacy_papers)
+    paper_text_bytes = text_bytes(papers)
+
+    print("papers: %d" % args.papers)
+    print(
+        "plain dataclass: %d bytes per paper, %d excluding title, abstract and id"
+        % (
+            legacy_bytes / args.papers,
+            (legacy_bytes - legacy_text_bytes) / args.papers,
+        )
+    )
+    print(
+        "slotted with interned authors: %d bytes per paper, %d excluding title, abstract and id"
+        % (paper_bytes / args.papers, (paper_bytes - paper_text_bytes) / args.papers)
+    )
+    print(
+        "dataclasses.asdict: %.1f ms, to_dict: %.1f ms"
+        % (
+            time_to_dict(legacy_papers, dataclasses.asdict) * 1000,
+            time_to_dict(papers, Paper.to_dict) * 1000,
+        )
+    )
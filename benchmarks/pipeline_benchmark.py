@@ -0,0 +1,481 @@
+"""
+Times every stage of the daily pipeline on synthetic corpora without touching the network. Each corpus is
+written out as arxiv rss feeds, semantic scholar responses and LLM completions, which a local stub server replays
+(the LLM answers come from openai_stub_server.py). The server runs in its own process, so it does not compete with
+the pipeline for the GIL.
+Stages are timed in the order the pipeline runs them, and the timings are written to a json report that
+--baseline compares against an earlier report, so performance work on any stage can be measured and regressions
+caught.
+Run from the repo root: python benchmarks/pipeline_benchmark.py [--sizes 1000,10000,100000] [--baseline old.json]
+"""
+
+import argparse
+import configparser
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from openai import OpenAI  # noqa: E402
+
+import main  # noqa: E402
+import openai_stub_server  # noqa: E402
+from arxiv_scraper import FeedFetcher  # noqa: E402
+from author_index import AuthorIndex  # noqa: E402
+from filter_papers import (  # noqa: E402
+    GPTScorer,
+    filter_by_author,
+    filter_papers_by_hindex,
+    merge_scored_batches,
+    paper_to_string,
+    parse_samples,
+)
+from parse_json_to_md import write_md  # noqa: E402
+from push_to_slack import build_block_list, render_paper, render_title  # noqa: E402
+from rss_parser import parse_feed  # noqa: E402
+
+AREAS = ["cs.LG", "cs.CL", "cs.AI"]
+WORDS = (
+    "learning model training data network attention diffusion language reasoning agent policy reward "
+    "graph kernel robust sparse scaling retrieval alignment inference sampling gradient benchmark vision "
+    "multimodal planning uncertainty calibration privacy federated causal generalization optimization"
+).split()
+FIRST_NAMES = "Ada Bob Chen Dan Eva Farah Grace Hiro Ines Jun Kofi Lena Mia Niaj Olga Pavel Quinn Ravi Sara Tom"
+SURNAMES = "Smith Nguyen Okafor Ivanov Tanaka Müller Garcia Kim Rossi Cohen Singh Dubois Silva Novak Larsen"
+
+
+class Corpus:
+    """
+    A synthetic day of arxiv papers and what semantic scholar knows about their authors. Author names follow a
+    long tailed distribution like real bylines, and a few papers are not indexed by semantic scholar yet, so
+    their authors have to be searched by name.
+    """
+
+    def __init__(self, num_papers: int, num_followed: int = 200, seed: int = 0):
+        rng = random.Random(seed)
+        num_names = max(100, num_papers * 2)
+        first_names, surnames = FIRST_NAMES.split(), SURNAMES.split()
+        names = [
+            rng.choice(first_names) + " " + rng.choice(surnames) + " " + str(i)
+            for i in range(num_names)
+        ]
+        # name -> semantic scholar authors with that name
+        self.aliases = {}
+        self.authors_by_id = {}
+        for name in names:
+            self.aliases[name] = []
+            for _ in range(rng.choice([1, 1, 1, 2, 3])):
+                author = {
+                    "authorId": str(len(self.authors_by_id)),
+                    "name": name,
+                    "hIndex": int(rng.expovariate(1 / 12)),
+                    "citationCount": rng.randrange(10000),
+                }
+                self.aliases[name].append(author)
+                self.authors_by_id[author["authorId"]] = author
+        self.followed_ids = {
+            str(rng.randrange(len(self.authors_by_id))) for _ in range(num_followed)
+        }
+        self.items = {area: [] for area in AREAS}
+        # arxiv id -> the authors semantic scholar lists on the paper
+        self.s2_papers = {}
+        for i in range(num_papers):
+            arxiv_id = "2402.%05d" % i
+            byline = [
+                names[min(int(rng.paretovariate(0.6)), num_names) - 1]
+                if rng.random() < 0.5
+                else rng.choice(names)
+                for _ in range(rng.randint(1, 10))
+            ]
+            byline = list(dict.fromkeys(byline))
+            area = AREAS[i % len(AREAS)]
+            self.items[area].append(
+                {
+                    "arxiv_id": arxiv_id,
+                    "title": " ".join(rng.choices(WORDS, k=rng.randint(6, 14))),
+                    "abstract": " ".join(rng.choices(WORDS, k=rng.randint(120, 250))),
+                    "authors": byline,
+                    # replaced and cross-listed papers are in the feeds, but skipped by the parser
+                    "announce_type": "new" if rng.random() < 0.85 else "replace",
+                }
+            )
+            if rng.random() < 0.99:
+                self.s2_papers[arxiv_id] = [
+                    {
+                        "authorId": self.aliases[name][i % len(self.aliases[name])][
+                            "authorId"
+                        ],
+                        "name": name,
+                    }
+                    for name in byline
+                ]
+        self.feeds = {area: self.render_feed(area) for area in AREAS}
+
+    def render_feed(self, area: str) -> bytes:
+        # the feed of the area in the current arxiv rss format
+        parts = [
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<rss xmlns:arxiv="http://arxiv.org/schemas/atom" xmlns:dc="http://purl.org/dc/elements/1.1/" '
+            'version="2.0">\n<channel>\n'
+            "<title>" + area + " updates on arXiv.org</title>\n"
+            "<lastBuildDate>Mon, 12 Feb 2024 05:00:00 +0000</lastBuildDate>\n"
+        ]
+        for item in self.items[area]:
+            parts.append(
+                "<item>\n<title>"
+                + escape(item["title"])
+                + "</title>\n<link>https://arxiv.org/abs/"
+                + item["arxiv_id"]
+                + "</link>\n<description>arXiv:"
+                + item["arxiv_id"]
+                + "v1 Announce Type: "
+                + item["announce_type"]
+                + " \nAbstract: "
+                + escape(item["abstract"])
+                + "</description>\n<category>"
+                + area
+                + "</category>\n<arxiv:announce_type>"
+                + item["announce_type"]
+                + "</arxiv:announce_type>\n<dc:creator>"
+                + escape(", ".join(item["authors"]))
+                + "</dc:creator>\n</item>\n"
+            )
+        parts.append("</channel>\n</rss>\n")
+        return "".join(parts).encode("utf-8")
+
+
+class ReplayHandler(openai_stub_server.StubHandler):
+    # serves the corpus' feeds and semantic scholar responses, and the LLM answers of the openai stub
+    corpus: Corpus = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.startswith("/rss/"):
+            data = self.corpus.feeds[url.path[len("/rss/") :]]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/rss+xml")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        elif url.path == "/graph/v1/author/search":
+            name = parse_qs(url.query)["query"][0]
+            self.send_json({"data": self.corpus.aliases.get(name, [])})
+        else:
+            super().do_GET()
+
+    def do_POST(self):
+        if self.path.startswith("/graph/v1/paper/batch"):
+            ids = json.loads(self.read_body())["ids"]
+            self.send_json(
+                [
+                    {
+                        "paperId": arxiv_id,
+                        "authors": self.corpus.s2_papers[arxiv_id[6:]],
+                    }
+                    if arxiv_id[6:] in self.corpus.s2_papers
+                    else None
+                    for arxiv_id in ids
+                ]
+            )
+        elif self.path.startswith("/graph/v1/author/batch"):
+            ids = json.loads(self.read_body())["ids"]
+            self.send_json([self.corpus.authors_by_id.get(i) for i in ids])
+        else:
+            super().do_POST()
+
+
+def serve(corpus: Corpus, ports: multiprocessing.Queue):
+    handler = type("CorpusHandler", (ReplayHandler,), {"corpus": corpus})
+    server = ThreadingHTTPServer(("localhost", 0), handler)
+    ports.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start_server(corpus: Corpus):
+    # returns the server process and its port
+    ports = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve, args=(corpus, ports), daemon=True)
+    process.start()
+    return process, ports.get()
+
+
+def load_config(with_llm: bool) -> configparser.ConfigParser:
+    # the repo's config without anything that would touch the disk caches or be rate limited
+    config = configparser.ConfigParser()
+    config.read("configs/config.ini")
+    config["FILTERING"]["arxiv_category"] = ",".join(AREAS)
+    config["SELECTION"]["run_openai"] = str(with_llm)
+    config["SELECTION"]["scoring_mode"] = "sync"
+    config["S2"]["requests_per_second_with_key"] = "1000000"
+    for section in ["completion_cache", "score_store", "feed_state", "author_cache"]:
+        config["CACHE"][section] = "false"
+    config["OUTPUT"]["debug_messages"] = "false"
+    config["OUTPUT"]["dump_debug_file"] = "false"
+    config["LLM"]["scoring_backend"] = "openai"
+    config["LLM"]["title_filter_backend"] = "openai"
+    config["LLM openai"]["requests_per_minute"] = "0"
+    config["LLM openai"]["stream"] = "false"
+    # the stub answers right away, so more requests in flight only measure our own overhead
+    config["LLM openai"]["max_in_flight"] = "16"
+    return config
+
+
+class StageTimer:
+    def __init__(self, repeats: int):
+        self.repeats = repeats
+        self.stages = {}
+
+    def time(self, name: str, fn, items: int = None, repeat=True):
+        """
+        Runs fn and records its wall time, the best of several runs for stages without side effects.
+        :param items: number of items the stage processes, for the throughput
+        :return: the result of fn
+        """
+        best = float("inf")
+        for _ in range(self.repeats if repeat else 1):
+            start = time.perf_counter()
+            result = fn()
+            best = min(best, time.perf_counter() - start)
+        self.stages[name] = {"seconds": round(best, 6)}
+        if items is not None:
+            self.stages[name]["items"] = items
+            self.stages[name]["items_per_second"] = round(items / max(best, 1e-9), 1)
+        return result
+
+
+def render_md(selected_papers: dict):
+    # renders to os.devnull, so disk speed does not count
+    with open(os.devnull, "w") as f:
+        write_md(selected_papers, f)
+
+
+def run_size(num_papers: int, repeats: int, with_llm: bool, seed: int) -> dict:
+    corpus = Corpus(num_papers, seed=seed)
+    server, port = start_server(corpus)
+    base_url = "http://localhost:%d" % port
+    main.S2_API_URL = base_url + "/graph/v1"
+    config = load_config(with_llm)
+    timer = StageTimer(repeats)
+    try:
+        timer.time(
+            "rss_parse",
+            lambda: [parse_feed(corpus.feeds[area], area, True) for area in AREAS],
+            items=num_papers,
+        )
+        fetcher = FeedFetcher(pool_size=len(AREAS))
+        fetcher.feed_url = base_url + "/rss/{area}"
+        papers = timer.time(
+            "fetch_feeds",
+            lambda: sorted(
+                main.get_papers_from_arxiv(config, fetcher),
+                key=lambda paper: paper.arxiv_id,
+            ),
+            items=num_papers,
+            repeat=False,
+        )
+        fetcher.close()
+        all_authors = timer.time(
+            "author_resolution",
+            lambda: main.resolve_authors(papers, "stub", config),
+            items=len(papers),
+            repeat=False,
+        )
+        index = timer.time(
+            "author_index",
+            lambda: AuthorIndex.build(all_authors, corpus.followed_ids),
+            items=len(all_authors),
+        )
+        selected_papers, all_papers, sort_dict = timer.time(
+            "filter_by_author",
+            lambda: filter_by_author(
+                all_authors, papers, corpus.followed_ids, config, index
+            ),
+            items=len(papers),
+        )
+        paper_list = timer.time(
+            "filter_papers_by_hindex",
+            lambda: filter_papers_by_hindex(all_authors, papers, config, index),
+            items=len(papers),
+        )
+        scorer = GPTScorer(
+            config, OpenAI(api_key="stub", base_url=base_url + "/v1", max_retries=0)
+        )
+        batches = timer.time(
+            "batching", lambda: scorer.make_batches(paper_list), items=len(paper_list)
+        )
+        prompts = timer.time(
+            "prompts",
+            lambda: [
+                scorer.layout.scoring_prompt([paper_to_string(p) for p in batch])
+                for batch in batches
+            ],
+            items=len(batches),
+        )
+        # completions as the stub answers them, to time parsing on its own
+        texts = [
+            openai_stub_server.complete(
+                {
+                    "model": scorer.scoring_backend.model,
+                    "messages": [{"role": "user", "content": prompt}],
+                }
+            )["choices"][0]["message"]["content"]
+            for prompt in prompts
+        ]
+        batch_results = timer.time(
+            "json_parsing",
+            lambda: [(parse_samples([text], config), 0.0) for text in texts],
+            items=len(texts),
+        )
+        if with_llm:
+            filtered = timer.time(
+                "title_filter",
+                lambda: scorer.filter_titles(paper_list)[0],
+                items=len(paper_list),
+                repeat=False,
+            )
+            batch_results = timer.time(
+                "gpt_scoring",
+                lambda: scorer.score_batches(scorer.make_batches(filtered)),
+                items=len(filtered),
+                repeat=False,
+            )
+        scorer.close()
+        timer.time(
+            "merge_scores",
+            lambda: merge_scored_batches(
+                batch_results, config, all_papers, selected_papers, sort_dict
+            ),
+            items=len(batch_results),
+            repeat=False,
+        )
+        ranked = sorted(sort_dict, key=sort_dict.get, reverse=True)
+        selected_papers = {key: selected_papers[key] for key in ranked}
+        timer.time(
+            "render_md",
+            lambda: render_md(selected_papers),
+            items=len(selected_papers),
+        )
+        timer.time(
+            "slack_blocks",
+            lambda: build_block_list(
+                [render_title(p, i) for i, p in enumerate(selected_papers.values())],
+                [render_paper(p, i) for i, p in enumerate(selected_papers.values())],
+            ),
+            items=len(selected_papers),
+        )
+    finally:
+        server.terminate()
+        server.join()
+    return {
+        "papers_in_feeds": num_papers,
+        "new_papers": len(papers),
+        "authors": len(all_authors),
+        "batches": len(batches),
+        "selected": len(selected_papers),
+        "stages": timer.stages,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    # prints every stage against the baseline, returns the stages that got slower by more than tolerance
+    regressions = []
+    for size, results in report["sizes"].items():
+        if size not in baseline["sizes"]:
+            continue
+        print("\n%s papers vs baseline %s" % (size, baseline.get("commit")))
+        for stage, timing in results["stages"].items():
+            old = baseline["sizes"][size]["stages"].get(stage)
+            if old is None:
+                continue
+            ratio = timing["seconds"] / max(old["seconds"], 1e-9)
+            flag = ""
+            # stages this fast are mostly noise
+            if ratio > tolerance and timing["seconds"] > 0.01:
+                flag = "  REGRESSION"
+                regressions.append((size, stage, ratio))
+            print(
+                "  %-24s %9.3fs -> %9.3fs  %5.2fx%s"
+                % (stage, old["seconds"], timing["seconds"], ratio, flag)
+            )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--skip-llm",
+        action="store_true",
+        help="skip the title filter and scoring requests to the LLM stub",
+    )
+    parser.add_argument("--output", default="out/pipeline_benchmark.json")
+    parser.add_argument("--baseline", help="an earlier report to compare against")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1.25,
+        help="stages slower than the baseline by more than this factor fail the run",
+    )
+    args = parser.parse_args()
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeats": args.repeats,
+        "sizes": {},
+    }
+    for size in [int(size) for size in args.sizes.split(",")]:
+        start = time.perf_counter()
+        results = run_size(size, args.repeats, not args.skip_llm, args.seed)
+        report["sizes"][str(size)] = results
+        print(
+            "%d papers (%d new, %d authors, %d batches, %d selected) in %.1fs"
+            % (
+                size,
+                results["new_papers"],
+                results["authors"],
+                results["batches"],
+                results["selected"],
+                time.perf_counter() - start,
+            )
+        )
+        for stage, timing in results["stages"].items():
+            print(
+                "  %-24s %9.3fs %12s items/s"
+                % (stage, timing["seconds"], timing.get("items_per_second", ""))
+            )
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=4)
+    print("report written to " + args.output)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if len(regressions) > 0:
+            sys.exit(1)
@@ -0,0 +1,83 @@
+"""
+Compares the streaming rss parser against the original feedparser based one on a saved feed.
+Run from the repo root: python benchmarks/rss_parser_benchmark.py [path to a feed, optionally gzipped]
+The default fixture is a synthetic cs.LG feed in the current arxiv rss format with 1200 entries.
+"""
+
+import argparse
+import configparser
+import gzip
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from arxiv_scraper import parse_feed_with_feedparser  # noqa: E402
+from rss_parser import parse_feed  # noqa: E402
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "cs.LG.rss.xml.gz")
+
+
+def load_feed(path: str) -> bytes:
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        return f.read()
+
+
+def time_parser(parse, repeats: int):
+    # returns the result of the last run, the best wall time and the peak traced memory of a single run
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = parse()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    parse()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, best, peak
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("feed", nargs="?", default=FIXTURE)
+    parser.add_argument("--area", default="cs.LG")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--force-primary", action="store_true")
+    args = parser.parse_args()
+
+    content = load_feed(args.feed)
+    config = configparser.ConfigParser()
+    config["FILTERING"] = {"force_primary": str(args.force_primary)}
+    legacy, legacy_time, legacy_peak = time_parser(
+        lambda: parse_feed_with_feedparser(content, args.area, config), args.repeats
+    )
+    streaming, streaming_time, streaming_peak = time_parser(
+        lambda: parse_feed(content, args.area, args.force_primary), args.repeats
+    )
+
+    print("feed: %s (%d bytes)" % (args.feed, len(content)))
+    print(
+        "feedparser: %.1f ms, peak %.1f MB" % (legacy_time * 1000, legacy_peak / 2**20)
+    )
+    print(
+        "streaming:  %.1f ms, peak %.1f MB"
+        % (streaming_time * 1000, streaming_peak / 2**20)
+    )
+    print("speedup: %.1fx" % (legacy_time / streaming_time))
+    mismatches = [(old, new) for old, new in zip(legacy[0], streaming[0]) if old != new]
+    print(
+        "papers: %d vs %d, %d mismatched, same timestamp: %s, same last id: %s"
+        % (
+            len(legacy[0]),
+            len(streaming[0]),
+            len(mismatches),
+            legacy[1] == streaming[1],
+            legacy[2] == streaming[2],
+        )
+    )
+    for old, new in mismatches[:3]:
+        print("feedparser:", old)
+        print("streaming: ", new)
@@ -0,0 +1,131 @@
+"""
+Checkpoints of the daily run, so that a run that dies halfway (e.g. on an OpenAI outage) resumes where it stopped
+instead of fetching, resolving and paying for everything again.
+Each run gets a state directory keyed by the run date and a hash of the config, prompts and author list. The
+fetched papers and resolved authors are saved once their stage completes, and every title filter chunk and scored
+batch is saved as soon as its answer is in. A relaunch with the same date and config loads whatever is there and
+only does the rest. The state directory is removed once the run has written its outputs.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import date
+from typing import List
+
+from arxiv_scraper import Paper
+
+# files whose contents change what a run selects, on top of config.ini
+CONFIG_FILES = [
+    "configs/base_prompt.txt",
+    "configs/paper_topics.txt",
+    "configs/postfix_prompt.txt",
+    "configs/authors.txt",
+]
+# sections that do not change what a run selects
+IGNORED_SECTIONS = ["OUTPUT", "CACHE"]
+
+
+def config_hash(config) -> str:
+    digest = hashlib.sha256()
+    for section in config.sections():
+        if section in IGNORED_SECTIONS:
+            continue
+        for key, value in sorted(config[section].items()):
+            digest.update((section + "." + key + "=" + value + "\n").encode("utf-8"))
+    for path in CONFIG_FILES:
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                digest.update(f.read())
+        digest.update(b"\0")
+    return digest.hexdigest()[:16]
+
+
+def units_key(kind: str, papers: List[Paper]) -> str:
+    # a unit of work is identified by what it does and the papers it does it on
+    digest = hashlib.sha256()
+    for paper in papers:
+        digest.update(paper.arxiv_id.encode("utf-8") + b"\0")
+    return kind + "_" + digest.hexdigest()[:16]
+
+
+class RunCheckpoint:
+    def __init__(self, state_dir: str):
+        self.state_dir = state_dir
+        os.makedirs(os.path.join(state_dir, "units"), exist_ok=True)
+
+    @classmethod
+    def open(cls, config, run_date: date = None):
+        """
+        Opens the state directory of the run, and deletes the ones of unfinished runs older than
+        run_checkpoint_keep_days.
+        :return: the checkpoint, or None if run checkpoints are off
+        """
+        if not config["CACHE"].getboolean("run_checkpoint"):
+            return None
+        run_date = run_date or date.today()
+        runs_dir = os.path.join(config["CACHE"]["cache_dir"], "runs")
+        keep_seconds = float(config["CACHE"]["run_checkpoint_keep_days"]) * 24 * 60 * 60
+        if os.path.isdir(runs_dir):
+            for name in os.listdir(runs_dir):
+                path = os.path.join(runs_dir, name)
+                if time.time() - os.path.getmtime(path) > keep_seconds:
+                    shutil.rmtree(path, ignore_errors=True)
+        return cls(
+            os.path.join(runs_dir, run_date.isoformat() + "_" + config_hash(config))
+        )
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.state_dir, name + ".json")
+
+    def has(self, name: str) -> bool:
+        return os.path.exists(self.path(name))
+
+    def load(self, name: str):
+        # returns the saved value or None if it has not been saved yet
+        if not self.has(name):
+            return None
+        with open(self.path(name), "r") as f:
+            return json.load(f)
+
+    def save(self, name: str, value):
+        # write to a temporary file first so that a crash never leaves a half written checkpoint behind.
+        # units are saved from several threads, so each one gets its own temporary file
+        path = self.path(name)
+        tmp_path = path + "." + str(threading.get_ident()) + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(value, f)
+        os.replace(tmp_path, path)
+
+    def load_papers(self) -> List[Paper]:
+        papers = self.load("papers")
+        if papers is None:
+            return None
+        return [Paper(**paper) for paper in papers]
+
+    def save_papers(self, papers: List[Paper]):
+        self.save("papers", [paper.to_dict() for paper in papers])
+
+    def load_authors(self) -> dict:
+        return self.load("authors")
+
+    def save_authors(self, all_authors: dict):
+        self.save("authors", all_authors)
+
+    def save_unit(self, kind: str, papers: List[Paper], value):
+        self.save(os.path.join("units", units_key(kind, papers)), value)
+
+    def load_units(self, kind: str) -> list:
+        # every unit of the kind saved so far
+        units = []
+        for name in sorted(os.listdir(os.path.join(self.state_dir, "units"))):
+            if name.startswith(kind + "_") and name.endswith(".json"):
+                units.append(self.load(os.path.join("units", name[: -len(".json")])))
+        return units
+
+    def finish(self):
+        # the run made it to its outputs, so there is nothing left to resume
+        shutil.rmtree(self.state_dir, ignore_errors=True)
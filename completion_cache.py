@@ -0,0 +1,83 @@
+"""
+Persistent cache of chat completions keyed on everything that determines the response,
+so that re-running a day (e.g. after changing the score cutoffs) does not pay for the same prompts again.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+from openai.types.chat import ChatCompletion
+
+from disk_cache import DiskCache, MISSING
+
+
+class CompletionCache:
+    def __init__(self, cache: DiskCache):
+        self.cache = cache
+        # dollar cost of the requests that were answered from the cache
+        self.saved_cost = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(
+        model: str,
+        temperature: float,
+        seed: int,
+        prompt: str,
+        n: int = 1,
+        response_format: dict = None,
+        base_url: str = None,
+    ) -> str:
+        """
+        :param base_url: endpoint of the backend, since backends can serve different models under the same name
+        """
+        request = {
+            "base_url": base_url,
+            "model": model,
+            "temperature": temperature,
+            "seed": seed,
+            "prompt": prompt,
+        }
+        # n is only part of the key when sampling, so single sample keys stay the same
+        if n != 1:
+            request["n"] = n
+        if response_format is not None:
+            request["response_format"] = response_format
+        payload = json.dumps(request, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        # returns the cached ChatCompletion or None
+        value = self.cache.get(key)
+        if value is MISSING:
+            return None
+        return ChatCompletion.model_validate(value)
+
+    def set(self, key: str, completion: ChatCompletion):
+        # the full completion is stored so that both the text and the token usage survive
+        self.cache.set(key, completion.model_dump(mode="json"))
+
+    def record_saved(self, cost: float):
+        with self._lock:
+            self.saved_cost += cost
+
+    def stats(self) -> dict:
+        return {**self.cache.stats(), "saved_cost": self.saved_cost}
+
+    def close(self):
+        self.cache.close()
+
+
+def open_completion_cache(config):
+    if not config["CACHE"].getboolean("completion_cache"):
+        return None
+    return CompletionCache(
+        DiskCache(
+            os.path.join(config["CACHE"]["cache_dir"], "completions.sqlite3"),
+            namespace="chat_completions",
+            ttl=float(config["CACHE"]["completion_ttl_days"]) * 24 * 60 * 60,
+            max_entries=int(config["CACHE"]["completion_max_entries"]),
+        )
+    )
@@ -0,0 +1,144 @@
+"""
+A small sqlite-backed key/value cache that persists network lookups between runs.
+Entries have a per-entry expiry time and the cache is bounded in size via LRU eviction.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# sentinel returned by DiskCache.get when a key is absent or expired
+MISSING = object()
+
+
+class DiskCache:
+    def __init__(
+        self,
+        path: str,
+        namespace: str,
+        ttl: float,
+        max_entries: int = 0,
+        commit_every: int = 100,
+    ):
+        """
+        :param path: sqlite file to store the cache in. it is created if it does not exist
+        :param namespace: caches for different things can share a file by using different namespaces
+        :param ttl: default time to live of an entry in seconds
+        :param max_entries: max number of entries kept in this namespace, 0 means unbounded
+        :param commit_every: number of writes between commits to disk
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.commit_every = commit_every
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._pending_writes = 0
+        # the cache gets shared across worker threads, so guard the connection with a lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT, "
+            "expires REAL NOT NULL, last_access REAL NOT NULL, "
+            "PRIMARY KEY (namespace, key))"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS entries_lru ON entries (namespace, last_access)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str):
+        # returns the stored value, or MISSING if the key is absent or expired
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires FROM entries WHERE namespace = ? AND key = ?",
+                (self.namespace, key),
+            ).fetchone()
+            if row is None or row[1] < now:
+                self.misses += 1
+                return MISSING
+            self._conn.execute(
+                "UPDATE entries SET last_access = ? WHERE namespace = ? AND key = ?",
+                (now, self.namespace, key),
+            )
+            self.hits += 1
+            return json.loads(row[0])
+
+    def set(self, key: str, value, ttl: float = None):
+        # stores any json-serializable value, including None for negative caching
+        now = time.time()
+        expires = now + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (namespace, key, value, expires, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, key, json.dumps(value), expires, now),
+            )
+            self.writes += 1
+            self._pending_writes += 1
+            if self._pending_writes >= self.commit_every:
+                self._conn.commit()
+                self._pending_writes = 0
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM entries WHERE namespace = ?", (self.namespace,)
+            ).fetchone()[0]
+
+    def evict(self):
+        # drop expired entries, then the least recently used ones until we are under max_entries
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM entries WHERE namespace = ? AND expires < ?",
+                (self.namespace, time.time()),
+            )
+            self.evictions += cursor.rowcount
+            if self.max_entries > 0:
+                count = self._conn.execute(
+                    "SELECT COUNT(*) FROM entries WHERE namespace = ?",
+                    (self.namespace,),
+                ).fetchone()[0]
+                if count > self.max_entries:
+                    cursor = self._conn.execute(
+                        "DELETE FROM entries WHERE rowid IN ("
+                        "SELECT rowid FROM entries WHERE namespace = ? "
+                        "ORDER BY last_access LIMIT ?)",
+                        (self.namespace, count - self.max_entries),
+                    )
+                    self.evictions += cursor.rowcount
+            self._conn.commit()
+            self._pending_writes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+            "writes": self.writes,
+            "evictions": self.evictions,
+        }
+
+    def close(self):
+        self.evict()
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
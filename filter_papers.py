@@ -1,98 +1,271 @@
 import configparser
-import dataclasses
 import json
-import re
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 
-import retry
+import openai
 from openai import OpenAI
 from tqdm import tqdm
 
 from arxiv_scraper import Paper
 from arxiv_scraper import EnhancedJSONEncoder
-
-
-def filter_by_author(all_authors, papers, author_targets, config):
-    # filter and parse the papers
+from author_index import AuthorIndex
+from batch_scoring import run_batch_job
+from checkpoint import RunCheckpoint
+from completion_cache import CompletionCache, open_completion_cache
+from llm_backends import LLMBackend, cached_tokens, load_backend, load_stage_backends
+from local_filter import filter_papers_locally
+from prompt_layout import PromptLayout
+from score_parser import (
+    ParseStats,
+    ScoreRecordParser,
+    parse_id_list,
+    parse_score_records,
+    response_format_for,
+)
+from score_store import hash_prompts, open_score_store
+from telemetry import metrics
+from rate_limit import backoff_delay, retry_after_seconds
+from token_count import count_tokens
+
+
+def filter_by_author(all_authors, papers, author_targets, config, index=None):
+    # filter and parse the papers. index is an AuthorIndex of all_authors and author_targets, built if not given
+    if index is None:
+        index = AuthorIndex.build(all_authors, author_targets)
     selected_papers = {}  # pass to output
     all_papers = {}  # dict for later filtering
     sort_dict = {}  # dict storing key and score
+    author_match_score = float(config["SELECTION"]["author_match_score"])
 
     # author based selection
     for paper in papers:
         all_papers[paper.arxiv_id] = paper
-        for author in paper.authors:
-            if author in all_authors:
-                for alias in all_authors[author]:
-                    if alias["authorId"] in author_targets:
-                        selected_papers[paper.arxiv_id] = {
-                            **dataclasses.asdict(paper),
-                            **{"COMMENT": "Author match"},
-                        }
-                        sort_dict[paper.arxiv_id] = float(
-                            config["SELECTION"]["author_match_score"]
-                        )
-                        break
+        if index.has_watched_author(paper):
+            selected_papers[paper.arxiv_id] = {
+                **paper.to_dict(),
+                **{"COMMENT": "Author match"},
+            }
+            sort_dict[paper.arxiv_id] = author_match_score
     return selected_papers, all_papers, sort_dict
 
 
-def filter_papers_by_hindex(all_authors, papers, config):
+def filter_papers_by_hindex(all_authors, papers, config, index=None):
     # filters papers by checking to see if there's at least one author with > hcutoff hindex
-    paper_list = []
-    for paper in papers:
-        max_h = 0
-        for author in paper.authors:
-            if author in all_authors:
-                max_h = max(
-                    max_h, max([alias["hIndex"] for alias in all_authors[author]])
-                )
-        if max_h >= float(config["FILTERING"]["hcutoff"]):
-            paper_list.append(paper)
-    return paper_list
-
-
-def calc_price(model, usage):
-    if model == "gpt-4-1106-preview":
-        return (0.01 * usage.prompt_tokens + 0.03 * usage.completion_tokens) / 1000.0
-    if model == "gpt-4":
-        return (0.03 * usage.prompt_tokens + 0.06 * usage.completion_tokens) / 1000.0
-    if (model == "gpt-3.5-turbo") or (model == "gpt-3.5-turbo-1106"):
-        return (0.0015 * usage.prompt_tokens + 0.002 * usage.completion_tokens) / 1000.0
-
-
-@retry.retry(tries=3, delay=2)
-def call_chatgpt(full_prompt, openai_client, model):
-    return openai_client.chat.completions.create(
-        model=model,
-        messages=[{"role": "user", "content": full_prompt}],
-        temperature=0.0,
-        seed=0,
+    if index is None:
+        index = AuthorIndex.build(all_authors)
+    hcutoff = float(config["FILTERING"]["hcutoff"])
+    if hcutoff <= 0:
+        # authors without semantic scholar data count as 0, so every paper passes
+        return list(papers)
+    names = index.names_with_hindex(hcutoff)
+    return [paper for paper in papers if not names.isdisjoint(paper.authors)]
+
+
+def call_chatgpt(
+    full_prompt,
+    backend: LLMBackend,
+    cache: CompletionCache = None,
+    tries=3,
+    temperature=0.0,
+    seed=0,
+    n=1,
+    response_format=None,
+    stage="scoring",
+    on_text=None,
+):
+    # returns the completion (with n choices) and its cost, which is zero if it was served from the cache.
+    # tokens and cost are accounted to the given pipeline stage in the run's metrics.
+    # on_text gets the text of each choice as it arrives, see LLMBackend.complete
+    if cache is not None:
+        key = CompletionCache.make_key(
+            backend.model,
+            temperature,
+            seed,
+            full_prompt,
+            n,
+            response_format,
+            backend.base_url,
+        )
+        completion = cache.get(key)
+        if completion is not None:
+            cache.record_saved(backend.price(completion.usage))
+            metrics.record_llm(stage, completion.usage, 0.0, cache_hit=True)
+            if on_text is not None:
+                for choice in completion.choices:
+                    on_text(choice.index, choice.message.content or "")
+            return completion, 0.0
+    for attempt in range(tries):
+        try:
+            completion = backend.complete(
+                full_prompt, temperature, seed, n, response_format, on_text
+            )
+            break
+        except (
+            openai.RateLimitError,
+            openai.InternalServerError,
+            openai.APIConnectionError,
+        ) as ex:
+            if attempt == tries - 1:
+                raise
+            metrics.count("llm_retries", backend=backend.name)
+            response = getattr(ex, "response", None)
+            delay = retry_after_seconds(response.headers if response else None)
+            if delay is None:
+                delay = backoff_delay(attempt, base_delay=2.0)
+            else:
+                # the api told us how long to wait, so hold off all the other workers too
+                backend.pause(delay)
+            time.sleep(delay)
+    backend.record_usage(completion.usage)
+    cost = backend.price(completion.usage)
+    metrics.record_llm(stage, completion.usage, cost, cached_tokens(completion.usage))
+    # streamed responses that broke off are used, but not cached
+    complete = all(choice.finish_reason is not None for choice in completion.choices)
+    if cache is not None and complete:
+        cache.set(key, completion)
+    return completion, cost
+
+
+def map_concurrently(fn, items, max_in_flight: int) -> list:
+    # applies fn to each item on a thread pool, returning results in the same order as items
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        return list(tqdm(executor.map(fn, items), total=len(items)))
+
+
+def sample_chatgpt(full_prompt, backend, config, cache=None, on_text=None):
+    """
+    Draws num_samples responses to the prompt. All samples are requested at once, either as the n choices of a
+    single request, or as parallel requests with different seeds for backends that don't support n.
+    :param on_text: called with the index of the sample and each piece of its text as it arrives
+    :return: the response texts and the total cost
+    """
+    num_samples = int(config["FILTERING"]["num_samples"])
+    response_format = response_format_for(backend.response_format)
+    if num_samples <= 1:
+        completion, cost = call_chatgpt(
+            full_prompt,
+            backend,
+            cache,
+            response_format=response_format,
+            on_text=on_text,
+        )
+        return [completion.choices[0].message.content], cost
+    temperature = float(config["FILTERING"]["sample_temperature"])
+    if config["FILTERING"]["sampling"] == "n":
+        completion, cost = call_chatgpt(
+            full_prompt,
+            backend,
+            cache,
+            temperature=temperature,
+            n=num_samples,
+            response_format=response_format,
+            on_text=on_text,
+        )
+        return [choice.message.content for choice in completion.choices], cost
+    with ThreadPoolExecutor(max_workers=num_samples) as executor:
+        results = list(
+            executor.map(
+                lambda seed: call_chatgpt(
+                    full_prompt,
+                    backend,
+                    cache,
+                    temperature=temperature,
+                    seed=seed,
+                    response_format=response_format,
+                    on_text=None
+                    if on_text is None
+                    else lambda index, text: on_text(seed, text),
+                ),
+                range(num_samples),
+            )
+        )
+    return (
+        [completion.choices[0].message.content for completion, _ in results],
+        sum(cost for _, cost in results),
     )
 
 
-def run_and_parse_chatgpt(full_prompt, openai_client, config):
-    # just runs the chatgpt prompt, tries to parse the resulting JSON
-    completion = call_chatgpt(full_prompt, openai_client, config["SELECTION"]["model"])
-    out_text = completion.choices[0].message.content
-    out_text = re.sub("```jsonl\n", "", out_text)
-    out_text = re.sub("```", "", out_text)
-    out_text = re.sub(r"\n+", "\n", out_text)
-    out_text = re.sub("},", "}", out_text).strip()
-    # split out_text line by line and parse each as a json.
-    json_dicts = []
-    for line in out_text.split("\n"):
-        # try catch block to attempt to parse json
-        try:
-            json_dicts.append(json.loads(line))
-        except Exception as ex:
+def aggregate_samples(samples, config):
+    """
+    Combines the score dicts of several samples into one dict per paper. RELEVANCE and NOVELTY become the mean
+    (or median) over the samples that scored the paper, with their variance alongside, and DISAGREEMENT is set
+    when the samples are further apart than sample_disagreement on either score.
+    """
+    aggregate = statistics.median
+    if config["FILTERING"]["sample_aggregation"] == "mean":
+        aggregate = statistics.mean
+    disagreement = float(config["FILTERING"]["sample_disagreement"])
+    by_id = {}
+    for json_dicts in samples:
+        for jdict in json_dicts:
+            try:
+                scores = (float(jdict["RELEVANCE"]), float(jdict["NOVELTY"]))
+            except (KeyError, TypeError, ValueError):
+                continue
+            by_id.setdefault(jdict.get("ARXIVID"), []).append((scores, jdict))
+    aggregated = []
+    for arxiv_id, scored in by_id.items():
+        relevances = [scores[0] for scores, _ in scored]
+        novelties = [scores[1] for scores, _ in scored]
+        relevance = aggregate(relevances)
+        # keep the comment of the sample that agrees most with the aggregate
+        _, closest = min(scored, key=lambda item: abs(item[0][0] - relevance))
+        aggregated.append(
+            {
+                "ARXIVID": arxiv_id,
+                "COMMENT": closest.get("COMMENT"),
+                "RELEVANCE": round(relevance, 2),
+                "NOVELTY": round(aggregate(novelties), 2),
+                "RELEVANCE_VARIANCE": round(statistics.pvariance(relevances), 2),
+                "NOVELTY_VARIANCE": round(statistics.pvariance(novelties), 2),
+                "NUM_SAMPLES": len(scored),
+                "DISAGREEMENT": max(relevances) - min(relevances) > disagreement
+                or max(novelties) - min(novelties) > disagreement,
+            }
+        )
+    return aggregated
+
+
+def parse_samples(texts, config, stats: ParseStats = None, parsers=None):
+    """
+    Parses the score records of every sampled response and aggregates the samples if there are several.
+    :param parsers: the ScoreRecordParser of each sample, if the responses were already parsed as they came in
+    """
+    samples = []
+    for i, text in enumerate(texts):
+        if parsers is None:
+            json_dicts, malformed = parse_score_records(text)
+        else:
+            json_dicts, malformed = parsers[i].records, parsers[i].failed
+        if malformed > 0:
+            if stats is not None:
+                stats.add(malformed_records=malformed)
             if config["OUTPUT"].getboolean("debug_messages"):
-                print("Exception happened " + str(ex))
-                print("Failed to parse LM output as json")
-                print(out_text)
-                print("RAW output")
-                print(completion.choices[0].message.content)
-            continue
-    return json_dicts, calc_price(config["SELECTION"]["model"], completion.usage)
+                print(str(malformed) + " malformed score records in LM output")
+                print(text)
+        samples.append(json_dicts)
+    if len(samples) == 1:
+        return samples[0]
+    return aggregate_samples(samples, config)
+
+
+def run_and_parse_chatgpt(full_prompt, backend, config, cache=None, stats=None):
+    # runs the chatgpt prompt and parses the score records of each sample while its response streams in
+    parsers = [
+        ScoreRecordParser()
+        for _ in range(max(1, int(config["FILTERING"]["num_samples"])))
+    ]
+    texts, cost = sample_chatgpt(
+        full_prompt,
+        backend,
+        config,
+        cache,
+        on_text=lambda index, text: parsers[index].feed(text),
+    )
+    return parse_samples(texts, config, stats, parsers), cost
 
 
 def paper_to_string(paper_entry: Paper) -> str:
@@ -118,34 +291,58 @@ def batched(items, batch_size):
     return [items[i : i + batch_size] for i in range(0, len(items), batch_size)]
 
 
+def pack_batches(paper_list, token_budget, max_papers, model):
+    """
+    Greedily packs papers, in order, into batches of at most max_papers papers whose rendered
+    paper strings add up to at most token_budget tokens. A paper that is over budget on its own gets its own batch.
+    :return: the batches and the token count of each batch
+    """
+    batches = []
+    batch_tokens = []
+    for paper in paper_list:
+        tokens = count_tokens(paper_to_string(paper), model)
+        if (
+            len(batches) == 0
+            or len(batches[-1]) >= max_papers
+            or batch_tokens[-1] + tokens > token_budget
+        ):
+            batches.append([])
+            batch_tokens.append(0)
+        batches[-1].append(paper)
+        batch_tokens[-1] += tokens
+    return batches, batch_tokens
+
+
 def filter_papers_by_title(
-    papers, config, openai_client, base_prompt, criterion
+    papers, config, backend, layout: PromptLayout, cache=None, stats=None
 ) -> List[Paper]:
-    filter_postfix = 'Identify any papers that are absolutely and completely irrelavent to the criteria, and you are absolutely sure your friend will not enjoy, formatted as a list of arxiv ids like ["ID1", "ID2", "ID3"..]. Be extremely cautious, and if you are unsure at all, do not add a paper in this list. You will check it in detail later.\n Directly respond with the list, do not add ANY extra text before or after the list. Even if every paper seems irrelevant, please keep at least TWO papers'
     batches_of_papers = batched(papers, 20)
+
+    def run_title_batch(batch):
+        full_prompt = layout.title_prompt([paper_to_titles(paper) for paper in batch])
+        return call_chatgpt(full_prompt, backend, cache, stage="title_filter")
+
+    results = map_concurrently(
+        run_title_batch, batches_of_papers, backend.max_in_flight
+    )
     final_list = []
     cost = 0
-    for batch in batches_of_papers:
-        papers_string = "".join([paper_to_titles(paper) for paper in batch])
-        full_prompt = (
-            base_prompt + "\n " + criterion + "\n" + papers_string + filter_postfix
-        )
-        model = config["SELECTION"]["model"]
-        completion = call_chatgpt(full_prompt, openai_client, model)
-        cost += calc_price(model, completion.usage)
+    for batch, (completion, batch_cost) in zip(batches_of_papers, results):
+        cost += batch_cost
         out_text = completion.choices[0].message.content
-        try:
-            filtered_set = set(json.loads(out_text))
-            for paper in batch:
-                if paper.arxiv_id not in filtered_set:
-                    final_list.append(paper)
-                else:
-                    print("Filtered out paper " + paper.arxiv_id)
-        except Exception as ex:
-            print("Exception happened " + str(ex))
-            print("Failed to parse LM output as list " + out_text)
-            print(completion)
-            continue
+        filtered_ids = parse_id_list(out_text, {paper.arxiv_id for paper in batch})
+        if stats is not None:
+            stats.add(title_batches=1, title_batches_unparsed=filtered_ids is None)
+        if filtered_ids is None:
+            # this is only a prefilter, so keep the whole batch for scoring rather than dropping it
+            print("Failed to parse LM output as list, keeping the batch " + out_text)
+            filtered_ids = []
+        filtered_set = set(filtered_ids)
+        for paper in batch:
+            if paper.arxiv_id not in filtered_set:
+                final_list.append(paper)
+            else:
+                print("Filtered out paper " + paper.arxiv_id)
     return final_list, cost
 
 
@@ -154,84 +351,423 @@ def paper_to_titles(paper_entry: Paper) -> str:
 
 
 def run_on_batch(
-    paper_batch, base_prompt, criterion, postfix_prompt, openai_client, config
+    paper_batch,
+    layout: PromptLayout,
+    backend,
+    config,
+    cache=None,
+    stats=None,
 ):
-    batch_str = [paper_to_string(paper) for paper in paper_batch]
-    full_prompt = "\n".join(
-        [
-            base_prompt,
-            criterion + "\n",
-            "\n\n".join(batch_str) + "\n",
-            postfix_prompt,
-        ]
+    full_prompt = layout.scoring_prompt(
+        [paper_to_string(paper) for paper in paper_batch]
     )
-    json_dicts, cost = run_and_parse_chatgpt(full_prompt, openai_client, config)
+    json_dicts, cost = run_and_parse_chatgpt(full_prompt, backend, config, cache, stats)
     return json_dicts, cost
 
 
-def filter_by_gpt(
-    all_authors, papers, config, openai_client, all_papers, selected_papers, sort_dict
-):
-    # deal with config parsing
-    with open("configs/base_prompt.txt", "r") as f:
-        base_prompt = f.read()
-    with open("configs/paper_topics.txt", "r") as f:
-        criterion = f.read()
-    with open("configs/postfix_prompt.txt", "r") as f:
-        postfix_prompt = f.read()
-    all_cost = 0
-    if config["SELECTION"].getboolean("run_openai"):
-        # filter first by hindex of authors to reduce costs.
-        paper_list = filter_papers_by_hindex(all_authors, papers, config)
-        if config["OUTPUT"].getboolean("debug_messages"):
-            print(str(len(paper_list)) + " papers after hindex filtering")
-        cost = 0
-        paper_list, cost = filter_papers_by_title(
-            paper_list, config, openai_client, base_prompt, criterion
+class GPTScorer:
+    """
+    Holds everything needed to score papers with GPT (prompts, backends, caches) so that papers can be
+    scored all at once by filter_by_gpt, or fed in incrementally by the streaming pipeline in main.py.
+    """
+
+    def __init__(self, config, openai_client=None, checkpoint: RunCheckpoint = None):
+        """
+        :param openai_client: client for the openai backend, created from the config if not given
+        :param checkpoint: if given, title filter chunks and scored batches are saved to it, and papers an
+        earlier attempt at the run already filtered or scored are not sent again
+        """
+        self.config = config
+        self.checkpoint = checkpoint
+        # arxiv id -> whether the title filter kept the paper / its score dict (None if it went unscored),
+        # from an earlier attempt at the run
+        self.checkpointed_titles = {}
+        self.checkpointed_scores = {}
+        if checkpoint is not None:
+            for unit in checkpoint.load_units("title_filter"):
+                kept = set(unit["kept"])
+                for arxiv_id in unit["ids"]:
+                    self.checkpointed_titles[arxiv_id] = arxiv_id in kept
+            for unit in checkpoint.load_units("scores"):
+                by_id = {jdict["ARXIVID"]: jdict for jdict in unit["scores"]}
+                for arxiv_id in unit["ids"]:
+                    self.checkpointed_scores[arxiv_id] = by_id.get(arxiv_id)
+        self.debug = config["OUTPUT"].getboolean("debug_messages")
+        # the backends hold the rate limiters, shared by all requests so that we stay under the api quotas
+        backends = load_stage_backends(config, openai_client)
+        self.scoring_backend = backends["scoring"]
+        self.title_filter_backend = backends["title_filter"]
+        # deal with config parsing
+        self.layout = PromptLayout.from_config_files(
+            self.scoring_backend.response_format != "text"
+        )
+        with open("configs/paper_topics.txt", "r") as f:
+            self.criterion = f.read()
+        self.max_in_flight = self.scoring_backend.max_in_flight
+        # papers a response did not score are requested again on their own, up to this many times
+        self.missing_retries = int(config["SELECTION"]["missing_retries"])
+        self.stats = ParseStats()
+        # batch submits all scoring prompts as one OpenAI batch job instead of a request per batch
+        self.scoring_mode = config["SELECTION"]["scoring_mode"]
+        if self.scoring_mode not in ["sync", "batch"]:
+            raise ValueError("Unknown scoring_mode " + self.scoring_mode)
+        # identical prompts from earlier runs are answered from disk
+        self.cache = open_completion_cache(config)
+        # papers scored in earlier runs under the same model and prompts are not sent again
+        prompts = [self.layout.scoring_prefix]
+        if int(config["FILTERING"]["num_samples"]) > 1:
+            # aggregated scores depend on how they were sampled, so keep them apart from single sample ones
+            prompts.append(
+                " ".join(
+                    config["FILTERING"][key]
+                    for key in [
+                        "num_samples",
+                        "sample_temperature",
+                        "sample_aggregation",
+                    ]
+                )
+            )
+        if self.scoring_backend.response_format != "text":
+            prompts.append(self.scoring_backend.response_format)
+        self.score_store = open_score_store(
+            config, hash_prompts(*prompts), self.scoring_backend.model
         )
-        if config["OUTPUT"].getboolean("debug_messages"):
+
+    def split_stored(self, paper_list):
+        # returns the stored score dicts and the papers that still need to be scored
+        if self.score_store is None:
+            return [], paper_list
+        stored_dicts = []
+        unscored_list = []
+        for paper in paper_list:
+            jdict = self.score_store.get(paper.arxiv_id)
+            if jdict is None:
+                unscored_list.append(paper)
+            else:
+                stored_dicts.append(jdict)
+        if self.debug:
+            print(
+                str(len(stored_dicts))
+                + " papers already scored, "
+                + str(len(unscored_list))
+                + " left to score"
+            )
+        return stored_dicts, unscored_list
+
+    @metrics.span("title_filter")
+    def filter_titles(self, paper_list):
+        cost = 0
+        title_filter = self.config["FILTERING"]["title_filter"]
+        if title_filter == "gpt":
+            kept = dict(self.checkpointed_titles)
+            unfiltered = [paper for paper in paper_list if paper.arxiv_id not in kept]
+            if len(unfiltered) < len(paper_list):
+                metrics.count(
+                    "checkpoint_papers_resumed",
+                    len(paper_list) - len(unfiltered),
+                    stage="title_filter",
+                )
+            if len(unfiltered) > 0:
+                kept_list, cost = filter_papers_by_title(
+                    unfiltered,
+                    self.config,
+                    self.title_filter_backend,
+                    self.layout,
+                    self.cache,
+                    self.stats,
+                )
+                kept_ids = [paper.arxiv_id for paper in kept_list]
+                if self.checkpoint is not None:
+                    self.checkpoint.save_unit(
+                        "title_filter",
+                        unfiltered,
+                        {
+                            "ids": [paper.arxiv_id for paper in unfiltered],
+                            "kept": kept_ids,
+                        },
+                    )
+                kept.update({paper.arxiv_id: False for paper in unfiltered})
+                kept.update({arxiv_id: True for arxiv_id in kept_ids})
+            paper_list = [paper for paper in paper_list if kept[paper.arxiv_id]]
+        elif title_filter == "local":
+            paper_list = filter_papers_locally(paper_list, self.criterion, self.config)
+        elif title_filter != "none":
+            raise ValueError("Unknown title_filter " + title_filter)
+        if self.debug:
             print(
                 str(len(paper_list))
                 + " papers after title filtering with cost of $"
                 + str(cost)
             )
-        all_cost += cost
+        return paper_list, cost
+
+    def make_batches(self, paper_list):
+        token_budget = int(self.config["SELECTION"]["batch_token_budget"])
+        if token_budget <= 0:
+            return batched(paper_list, int(self.config["SELECTION"]["batch_size"]))
+        batch_of_papers, batch_tokens = pack_batches(
+            paper_list,
+            token_budget,
+            int(self.config["SELECTION"]["batch_max_papers"]),
+            self.scoring_backend.model,
+        )
+        if self.debug and len(batch_tokens) > 0:
+            # fraction of the token budget that is actually filled with papers
+            efficiency = sum(batch_tokens) / (len(batch_tokens) * token_budget)
+            print(
+                "Packed "
+                + str(len(paper_list))
+                + " papers into "
+                + str(len(batch_of_papers))
+                + " batches with packing efficiency "
+                + str(round(efficiency, 3))
+            )
+        return batch_of_papers
 
-        # batch the remaining papers and invoke GPT
-        batch_of_papers = batched(paper_list, int(config["SELECTION"]["batch_size"]))
-        scored_batches = []
-        for batch in tqdm(batch_of_papers):
-            scored_in_batch = []
-            json_dicts, cost = run_on_batch(
-                batch, base_prompt, criterion, postfix_prompt, openai_client, config
+    @metrics.span("score_batch")
+    def score_batch(self, batch):
+        checkpointed_dicts, batch = self.split_checkpointed(batch)
+        if len(batch) == 0:
+            return checkpointed_dicts, 0
+        json_dicts, cost = run_on_batch(
+            batch,
+            self.layout,
+            self.scoring_backend,
+            self.config,
+            self.cache,
+            self.stats,
+        )
+        json_dicts, retry_cost = self.rescore_missing(batch, json_dicts)
+        self.store_scores(batch, json_dicts)
+        return checkpointed_dicts + json_dicts, cost + retry_cost
+
+    def split_checkpointed(self, batch):
+        # returns the score dicts an earlier attempt at the run saved for the batch, and the papers still to score
+        if len(self.checkpointed_scores) == 0:
+            return [], batch
+        checkpointed = [
+            paper for paper in batch if paper.arxiv_id in self.checkpointed_scores
+        ]
+        if len(checkpointed) > 0:
+            metrics.count(
+                "checkpoint_papers_resumed", len(checkpointed), stage="scoring"
             )
-            all_cost += cost
+        json_dicts = [
+            self.checkpointed_scores[paper.arxiv_id]
+            for paper in checkpointed
+            if self.checkpointed_scores[paper.arxiv_id] is not None
+        ]
+        return json_dicts, [
+            paper for paper in batch if paper.arxiv_id not in self.checkpointed_scores
+        ]
+
+    def rescore_missing(self, batch, json_dicts):
+        """
+        Requests the papers of the batch that the response did not score (malformed records, responses that
+        broke off, skipped papers) again, instead of retrying the whole batch. Records of papers that are not in
+        the batch are dropped.
+        :return: the score dicts of the papers in the batch and the cost of the extra requests
+        """
+        batch_ids = {paper.arxiv_id for paper in batch}
+        json_dicts = [
+            jdict for jdict in json_dicts if jdict.get("ARXIVID") in batch_ids
+        ]
+        scored = {jdict["ARXIVID"] for jdict in json_dicts}
+        self.stats.add(
+            papers_requested=len(batch_ids), papers_scored_first_try=len(scored)
+        )
+        cost = 0
+        for _ in range(self.missing_retries):
+            missing = [paper for paper in batch if paper.arxiv_id not in scored]
+            if len(missing) == 0:
+                break
+            self.stats.add(rerequests=1, rerequested_papers=len(missing))
+            missing_dicts, missing_cost = run_on_batch(
+                missing,
+                self.layout,
+                self.scoring_backend,
+                self.config,
+                self.cache,
+                self.stats,
+            )
+            cost += missing_cost
+            for jdict in missing_dicts:
+                if jdict.get("ARXIVID") in batch_ids and jdict["ARXIVID"] not in scored:
+                    json_dicts.append(jdict)
+                    scored.add(jdict["ARXIVID"])
+        self.stats.add(papers_missing=len(batch_ids - scored))
+        return json_dicts, cost
+
+    def store_scores(self, batch, json_dicts):
+        if self.checkpoint is not None:
+            self.checkpoint.save_unit(
+                "scores",
+                batch,
+                {"ids": [paper.arxiv_id for paper in batch], "scores": json_dicts},
+            )
+        if self.score_store is not None:
+            batch_ids = set(paper.arxiv_id for paper in batch)
             for jdict in json_dicts:
-                if (
-                    int(jdict["RELEVANCE"])
-                    >= int(config["FILTERING"]["relevance_cutoff"])
-                    and jdict["NOVELTY"] >= int(config["FILTERING"]["novelty_cutoff"])
-                    and jdict["ARXIVID"] in all_papers
-                ):
-                    selected_papers[jdict["ARXIVID"]] = {
-                        **dataclasses.asdict(all_papers[jdict["ARXIVID"]]),
-                        **jdict,
-                    }
-                    sort_dict[jdict["ARXIVID"]] = jdict["RELEVANCE"] + jdict["NOVELTY"]
-                scored_in_batch.append(
-                    {
-                        **dataclasses.asdict(all_papers[jdict["ARXIVID"]]),
-                        **jdict,
-                    }
+                if jdict.get("ARXIVID") in batch_ids:
+                    self.score_store.set(jdict)
+
+    @metrics.span("score_batches")
+    def score_batches(self, batches):
+        # scores all batches in the configured scoring_mode, returning (json_dicts, cost) per batch in order
+        if self.scoring_mode == "sync":
+            return map_concurrently(self.score_batch, batches, self.max_in_flight)
+        num_samples = int(self.config["FILTERING"]["num_samples"])
+        temperature, n = 0.0, 1
+        if num_samples > 1:
+            # the batch api supports n, so samples are always requested as choices of one request
+            temperature = float(self.config["FILTERING"]["sample_temperature"])
+            n = num_samples
+        # papers scored by an earlier attempt at the run are not submitted again
+        split = [self.split_checkpointed(batch) for batch in batches]
+        checkpointed_dicts = [json_dicts for json_dicts, _ in split]
+        batches = [batch for _, batch in split]
+        results = [(json_dicts, 0) for json_dicts in checkpointed_dicts]
+        pending = [i for i, batch in enumerate(batches) if len(batch) > 0]
+        prompts = [
+            self.layout.scoring_prompt([paper_to_string(paper) for paper in batches[i]])
+            for i in pending
+        ]
+        completions, costs = run_batch_job(
+            prompts,
+            self.scoring_backend,
+            self.config,
+            self.cache,
+            temperature,
+            n=n,
+            response_format=response_format_for(self.scoring_backend.response_format),
+        )
+        failed = []
+        for i, completion, cost in zip(pending, completions, costs):
+            batch = batches[i]
+            if completion is None:
+                failed.append(i)
+                continue
+            json_dicts = parse_samples(
+                [choice.message.content for choice in completion.choices],
+                self.config,
+                self.stats,
+            )
+            json_dicts, retry_cost = self.rescore_missing(batch, json_dicts)
+            self.store_scores(batch, json_dicts)
+            results[i] = (checkpointed_dicts[i] + json_dicts, cost + retry_cost)
+        if len(failed) > 0:
+            # requests that failed or expired in the batch job, or were cancelled after batch_max_wait_hours, are
+            # retried synchronously
+            if self.debug:
+                print(str(len(failed)) + " batch requests failed, retrying them")
+            retried = map_concurrently(
+                self.score_batch, [batches[i] for i in failed], self.max_in_flight
+            )
+            for i, (json_dicts, cost) in zip(failed, retried):
+                results[i] = (checkpointed_dicts[i] + json_dicts, cost)
+        return results
+
+    def close(self):
+        metrics.attach("parse_stats", self.stats.report())
+        if self.cache is not None:
+            metrics.attach("completion_cache", self.cache.stats())
+        if self.debug:
+            print("Parse stats: " + str(self.stats.report()))
+            for backend in dict.fromkeys(
+                [self.scoring_backend, self.title_filter_backend]
+            ):
+                print(
+                    "Prompt tokens of the "
+                    + backend.name
+                    + " backend: "
+                    + str(backend.usage_report())
                 )
-            scored_batches.append(scored_in_batch)
-        if config["OUTPUT"].getboolean("dump_debug_file"):
-            with open(
-                config["OUTPUT"]["output_path"] + "gpt_paper_batches.debug.json", "w"
-            ) as outfile:
-                json.dump(scored_batches, outfile, cls=EnhancedJSONEncoder, indent=4)
-        if config["OUTPUT"].getboolean("debug_messages"):
-            print("Total cost: $" + str(all_cost))
+        if self.debug and self.cache is not None:
+            print("Cost saved by completion cache: $" + str(self.cache.saved_cost))
+            print("Completion cache stats: " + str(self.cache.stats()))
+        if self.cache is not None:
+            self.cache.close()
+        if self.score_store is not None:
+            self.score_store.close()
+
+
+def merge_scored_batches(
+    batch_results, config, all_papers, selected_papers, sort_dict, scores=None
+) -> float:
+    # adds papers above the cutoffs to selected_papers/sort_dict, returns the total cost of the batches.
+    # if given, scores collects the score dicts of all scored papers, not just the selected ones
+    all_cost = 0
+    scored_batches = []
+    for json_dicts, cost in batch_results:
+        scored_in_batch = []
+        all_cost += cost
+        for jdict in json_dicts:
+            if scores is not None:
+                scores[jdict["ARXIVID"]] = jdict
+            if (
+                int(jdict["RELEVANCE"]) >= int(config["FILTERING"]["relevance_cutoff"])
+                and jdict["NOVELTY"] >= int(config["FILTERING"]["novelty_cutoff"])
+                and jdict["ARXIVID"] in all_papers
+            ):
+                selected_papers[jdict["ARXIVID"]] = {
+                    **all_papers[jdict["ARXIVID"]].to_dict(),
+                    **jdict,
+                }
+                sort_dict[jdict["ARXIVID"]] = jdict["RELEVANCE"] + jdict["NOVELTY"]
+            scored_in_batch.append(
+                {
+                    **all_papers[jdict["ARXIVID"]].to_dict(),
+                    **jdict,
+                }
+            )
+        scored_batches.append(scored_in_batch)
+    if config["OUTPUT"].getboolean("dump_debug_file"):
+        with open(
+            config["OUTPUT"]["output_path"] + "gpt_paper_batches.debug.json", "w"
+        ) as outfile:
+            json.dump(scored_batches, outfile, cls=EnhancedJSONEncoder, indent=4)
+    return all_cost
+
+
+@metrics.span("filter_by_gpt")
+def filter_by_gpt(
+    all_authors,
+    papers,
+    config,
+    openai_client,
+    all_papers,
+    selected_papers,
+    sort_dict,
+    scores=None,
+    index=None,
+    checkpoint: RunCheckpoint = None,
+):
+    all_cost = 0
+    if config["SELECTION"].getboolean("run_openai"):
+        scorer = GPTScorer(config, openai_client, checkpoint)
+        try:
+            # filter first by hindex of authors to reduce costs.
+            paper_list = filter_papers_by_hindex(all_authors, papers, config, index)
+            if config["OUTPUT"].getboolean("debug_messages"):
+                print(str(len(paper_list)) + " papers after hindex filtering")
+            stored_dicts, paper_list = scorer.split_stored(paper_list)
+            paper_list, cost = scorer.filter_titles(paper_list)
+            all_cost += cost
+
+            # batch the remaining papers and invoke GPT
+            batch_of_papers = scorer.make_batches(paper_list)
+            # batches are scored concurrently, but merged in order so the output matches a serial run
+            batch_results = scorer.score_batches(batch_of_papers)
+            # stored scores get merged like an extra batch that cost nothing
+            if len(stored_dicts) > 0:
+                batch_results = [(stored_dicts, 0)] + batch_results
+            all_cost += merge_scored_batches(
+                batch_results, config, all_papers, selected_papers, sort_dict, scores
+            )
+            if config["OUTPUT"].getboolean("debug_messages"):
+                print("Total cost: $" + str(all_cost))
+        finally:
+            scorer.close()
 
 
 if __name__ == "__main__":
@@ -241,14 +777,12 @@ if __name__ == "__main__":
     keyconfig = configparser.ConfigParser()
     keyconfig.read("configs/keys.ini")
     S2_API_KEY = keyconfig["KEYS"]["semanticscholar"]
-    openai_client = OpenAI(api_key=keyconfig["KEYS"]["openai"])
-    # deal with config parsing
-    with open("configs/base_prompt.txt", "r") as f:
-        base_prompt = f.read()
-    with open("configs/paper_topics.txt", "r") as f:
-        criterion = f.read()
-    with open("configs/postfix_prompt.txt", "r") as f:
-        postfix_prompt = f.read()
+    backend = load_backend(
+        config,
+        config["LLM"]["scoring_backend"],
+        OpenAI(api_key=keyconfig["KEYS"]["openai"]),
+    )
+    layout = PromptLayout.from_config_files(backend.response_format != "text")
     # loads papers from 'in/debug_papers.json' and filters them
     with open("in/debug_papers.json", "r") as f:
         # with open("in/gpt_paper_batches.debug-11-10.json", "r") as f:
@@ -270,15 +804,13 @@ if __name__ == "__main__":
     sort_dict = {}
     total_cost = 0
     for batch in tqdm(papers):
-        json_dicts, cost = run_on_batch(
-            batch, base_prompt, criterion, postfix_prompt, openai_client, config
-        )
+        json_dicts, cost = run_on_batch(batch, layout, backend, config)
         total_cost += cost
         for paper in batch:
             all_papers[paper.arxiv_id] = paper
         for jdict in json_dicts:
             paper_outputs[jdict["ARXIVID"]] = {
-                **dataclasses.asdict(all_papers[jdict["ARXIVID"]]),
+                **all_papers[jdict["ARXIVID"]].to_dict(),
                 **jdict,
             }
             sort_dict[jdict["ARXIVID"]] = jdict["RELEVANCE"] + jdict["NOVELTY"]
@@ -0,0 +1,291 @@
+"""
+The language models the pipeline talks to. Each [LLM <name>] section of the config describes an OpenAI compatible
+backend (the OpenAI api, or a local vLLM/llama.cpp server), and [LLM] picks the backend of each stage, so that the
+high volume title filter can run on a cheap local model while the final scoring uses an expensive one.
+All backends share one pooled HTTP client, and each backend caps its own concurrent requests and request rate.
+"""
+
+import os
+import threading
+from typing import Dict, Tuple
+
+import httpx
+import openai
+from openai import OpenAI
+from openai.types import CompletionUsage
+from openai.types.chat import ChatCompletion, ChatCompletionMessage
+from openai.types.chat.chat_completion import Choice
+
+from rate_limit import MinuteRateLimiter
+from token_count import count_tokens
+
+_http_client = None
+_http_client_lock = threading.Lock()
+
+
+def shared_http_client(config) -> httpx.Client:
+    # one connection pool for all backends, so connections are kept alive across stages and requests
+    global _http_client
+    with _http_client_lock:
+        if _http_client is None:
+            section = config["LLM"]
+            kwargs = dict(
+                limits=httpx.Limits(
+                    max_connections=int(section["max_connections"]),
+                    max_keepalive_connections=int(section["max_connections"]),
+                    keepalive_expiry=float(section["keepalive_seconds"]),
+                ),
+                timeout=httpx.Timeout(float(section["timeout_seconds"]), connect=10.0),
+            )
+            try:
+                _http_client = httpx.Client(http2=section.getboolean("http2"), **kwargs)
+            except ImportError:
+                # http2 needs the h2 package
+                if config["OUTPUT"].getboolean("debug_messages"):
+                    print("h2 is not installed, falling back to HTTP/1.1")
+                _http_client = httpx.Client(**kwargs)
+        return _http_client
+
+
+def load_price(section) -> Tuple[float, ...]:
+    # (usd per 1k prompt tokens, usd per 1k completion tokens[, usd per 1k cached prompt tokens]) of the backend's
+    # model, from the price in its [LLM <name>] section. backends without a price, e.g. local ones, cost nothing
+    value = section.get("price", "")
+    if not value.strip():
+        return (0.0, 0.0)
+    return tuple(float(price) for price in value.split(","))
+
+
+def cached_tokens(usage) -> int:
+    # prompt tokens the provider served from its prompt cache. the pinned client predates the field, so it
+    # arrives as an untyped extra (a dict), and servers without prompt caching leave it out
+    details = getattr(usage, "prompt_tokens_details", None)
+    if isinstance(details, dict):
+        return details.get("cached_tokens") or 0
+    return getattr(details, "cached_tokens", 0) or 0
+
+
+def calc_price(usage, price: Tuple[float, ...]) -> float:
+    prompt_price, completion_price = price[:2]
+    # cached prompt tokens cost the same as others unless the model has a cached price
+    cached_price = price[2] if len(price) > 2 else prompt_price
+    cached = cached_tokens(usage)
+    return (
+        prompt_price * (usage.prompt_tokens - cached)
+        + cached_price * cached
+        + completion_price * usage.completion_tokens
+    ) / 1000.0
+
+
+class LLMBackend:
+    def __init__(
+        self,
+        name: str,
+        client: OpenAI,
+        model: str,
+        max_in_flight: int,
+        limiter: MinuteRateLimiter = None,
+        price: Tuple[float, ...] = (0.0, 0.0),
+        response_format: str = "text",
+        stream: bool = False,
+    ):
+        """
+        :param client: OpenAI compatible client for the backend
+        :param max_in_flight: max concurrent requests to the backend, across all stages using it
+        :param limiter: rate limits of the backend, None for no limits
+        :param price: usd per 1k prompt and completion tokens, and optionally per 1k cached prompt tokens
+        :param response_format: how scores are requested, text (JSONL), json_object (JSON mode) or json_schema
+        (structured outputs)
+        :param stream: stream responses, so that a response that breaks off keeps what arrived before
+        """
+        self.name = name
+        self.client = client
+        self.base_url = str(client.base_url)
+        self.model = model
+        self.max_in_flight = max_in_flight
+        self.limiter = limiter
+        self.price_per_1k = price
+        self.response_format = response_format
+        self.stream = stream
+        self.semaphore = threading.BoundedSemaphore(max_in_flight)
+        # token usage of the requests sent to the backend, to see how much of the prompts the provider cached
+        self.usage = {"requests": 0, "prompt_tokens": 0, "cached_prompt_tokens": 0}
+        self._usage_lock = threading.Lock()
+
+    def price(self, usage) -> float:
+        return calc_price(usage, self.price_per_1k)
+
+    def record_usage(self, usage):
+        with self._usage_lock:
+            self.usage["requests"] += 1
+            self.usage["prompt_tokens"] += usage.prompt_tokens
+            self.usage["cached_prompt_tokens"] += cached_tokens(usage)
+
+    def usage_report(self) -> dict:
+        with self._usage_lock:
+            report = dict(self.usage)
+        report["uncached_prompt_tokens"] = (
+            report["prompt_tokens"] - report["cached_prompt_tokens"]
+        )
+        if report["prompt_tokens"] > 0:
+            report["cached_fraction"] = round(
+                report["cached_prompt_tokens"] / report["prompt_tokens"], 4
+            )
+        return report
+
+    def complete(
+        self,
+        full_prompt: str,
+        temperature=0.0,
+        seed=0,
+        n=1,
+        response_format=None,
+        on_text=None,
+    ) -> ChatCompletion:
+        """
+        :param on_text: called with the index of the choice and each piece of its text as it arrives. streamed
+        responses deliver it piece by piece, others all at once
+        """
+        kwargs = {}
+        if response_format is not None:
+            kwargs["response_format"] = response_format
+        with self.semaphore:
+            if self.limiter is not None:
+                self.limiter.acquire(count_tokens(full_prompt, self.model))
+            request = dict(
+                model=self.model,
+                messages=[{"role": "user", "content": full_prompt}],
+                temperature=temperature,
+                seed=seed,
+                n=n,
+                **kwargs,
+            )
+            if self.stream:
+                return self.complete_streamed(full_prompt, request, on_text)
+            completion = self.client.chat.completions.create(**request)
+        if on_text is not None:
+            for choice in completion.choices:
+                on_text(choice.index, choice.message.content or "")
+        return completion
+
+    def complete_streamed(
+        self, full_prompt: str, request: dict, on_text=None
+    ) -> ChatCompletion:
+        """
+        Collects a streamed response into a ChatCompletion. If the stream breaks off after some text arrived,
+        the text so far is returned with finish_reason None, so the records in it can still be used.
+        Streamed responses carry no usage, so it is estimated from token counts.
+        """
+        texts = {}
+        finish_reasons = {}
+        completion_id = None
+        try:
+            for chunk in self.client.chat.completions.create(stream=True, **request):
+                completion_id = chunk.id
+                for choice in chunk.choices:
+                    delta = choice.delta.content or ""
+                    texts[choice.index] = texts.get(choice.index, "") + delta
+                    if on_text is not None and len(delta) > 0:
+                        on_text(choice.index, delta)
+                    if choice.finish_reason is not None:
+                        finish_reasons[choice.index] = choice.finish_reason
+        except (openai.APIError, httpx.HTTPError):
+            # errors before any text arrived get retried, so on_text never sees a piece twice
+            if len(texts) == 0:
+                raise
+        prompt_tokens = count_tokens(full_prompt, self.model)
+        completion_tokens = sum(
+            count_tokens(text, self.model) for text in texts.values()
+        )
+        return ChatCompletion.construct(
+            id=completion_id,
+            object="chat.completion",
+            created=0,
+            model=self.model,
+            choices=[
+                Choice.construct(
+                    index=index,
+                    message=ChatCompletionMessage.construct(
+                        role="assistant", content=texts[index]
+                    ),
+                    finish_reason=finish_reasons.get(index),
+                )
+                for index in sorted(texts)
+            ],
+            usage=CompletionUsage(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_tokens=prompt_tokens + completion_tokens,
+            ),
+        )
+
+    def pause(self, seconds: float):
+        # the backend told us to back off, so hold off all the other requests to it too
+        if self.limiter is not None:
+            self.limiter.pause(seconds)
+
+
+def make_client(config, name: str) -> OpenAI:
+    section = config["LLM " + name]
+    api_key = "none"
+    if section.get("api_key_env"):
+        api_key = os.environ.get(section["api_key_env"])
+        if api_key is None:
+            raise ValueError(
+                "API key of the "
+                + name
+                + " backend is not set - please set "
+                + section["api_key_env"]
+            )
+    # OPENAI_BASE_URL points backends without a base_url at another endpoint, e.g. a local stub server
+    return OpenAI(
+        api_key=api_key,
+        base_url=section.get("base_url") or os.environ.get("OPENAI_BASE_URL"),
+        http_client=shared_http_client(config),
+    )
+
+
+def load_backend(config, name: str, client: OpenAI = None) -> LLMBackend:
+    """
+    Settings missing from the [LLM <name>] section default to the ones in [SELECTION].
+    :param client: use this client instead of creating one from the section
+    """
+    section = config["LLM " + name]
+    selection = config["SELECTION"]
+    requests_per_minute = float(
+        section.get("requests_per_minute", selection["requests_per_minute"])
+    )
+    tokens_per_minute = float(
+        section.get("tokens_per_minute", selection["tokens_per_minute"])
+    )
+    limiter = None
+    if requests_per_minute > 0 and tokens_per_minute > 0:
+        limiter = MinuteRateLimiter(requests_per_minute, tokens_per_minute)
+    return LLMBackend(
+        name,
+        client if client is not None else make_client(config, name),
+        section.get("model", selection["model"]),
+        int(section.get("max_in_flight", selection["max_in_flight"])),
+        limiter,
+        load_price(section),
+        section.get("response_format", "text"),
+        section.getboolean("stream", False),
+    )
+
+
+def load_stage_backends(config, openai_client: OpenAI = None) -> Dict[str, LLMBackend]:
+    """
+    :param openai_client: if given, used as the client of the openai backend
+    :return: stage ("scoring", "title_filter") -> backend. stages on the same backend share one LLMBackend,
+    so they share its concurrency and rate limits
+    """
+    backends = {}
+    stage_backends = {}
+    for stage in ["scoring", "title_filter"]:
+        name = config["LLM"][stage + "_backend"]
+        if name not in backends:
+            backends[name] = load_backend(
+                config, name, openai_client if name == "openai" else None
+            )
+        stage_backends[stage] = backends[name]
+    return stage_backends
@@ -0,0 +1,135 @@
+"""
+A local, api-free alternative to the GPT title filter. Each paper (title + abstract) and each criterion
+in paper_topics.txt is turned into a tf-idf vector, and papers that are not similar enough to any criterion
+are dropped before the expensive GPT scoring.
+"""
+
+import re
+from typing import List
+
+import numpy as np
+
+from arxiv_scraper import Paper
+
+# every byte that is not part of a word becomes a space, so that tokenizing is a single bytes.translate and split.
+# bytes >= 128 are kept so that utf-8 encoded non-ascii letters stay inside their words
+WORD_BYTES = b"abcdefghijklmnopqrstuvwxyz0123456789-" + bytes(range(128, 256))
+# separates the texts when the whole corpus is tokenized in one pass. NUL can not appear in the xml feeds
+SEPARATOR_TOKEN = b"\0"
+TOKENIZE_TABLE = bytes(
+    c if c in WORD_BYTES + SEPARATOR_TOKEN else ord(" ") for c in range(256)
+)
+CRITERION_START = re.compile(r"^\s*\d+[.)]\s")
+STOPWORDS = frozenset(
+    b"a an and are as at be by can for from has have in is it its of on or that the "
+    b"their these this to we with which our not more than such into using use used "
+    b"also both only other papers paper relevant".split()
+)
+SEPARATOR = -2
+IGNORED = -1
+
+
+def split_criteria(criterion: str) -> List[str]:
+    """
+    Splits paper_topics.txt into one query per numbered criterion (with its sub-bullets) plus one for any
+    free-form text. "Not relevant" bullets are dropped, since matching on them would do the opposite of what we want.
+    """
+    criteria = []
+    current = []
+    for line in criterion.split("\n"):
+        stripped = line.strip()
+        if stripped.startswith("#") or stripped.lower().startswith("- not relevant"):
+            continue
+        if CRITERION_START.match(line) or (not stripped and current):
+            if current:
+                criteria.append(" ".join(current))
+            current = []
+        if stripped:
+            current.append(stripped)
+    if current:
+        criteria.append(" ".join(current))
+    return criteria
+
+
+def tokenize_corpus(texts: List[str]):
+    """
+    Tokenizes all texts in one pass and maps tokens to term ids without a python loop per token.
+    :return: (text index, term id) coordinate arrays with one entry per token, and the vocabulary size
+    """
+    corpus = (b" " + SEPARATOR_TOKEN + b" ").join(
+        text.lower().encode("utf-8") for text in texts
+    )
+    tokens = corpus.translate(TOKENIZE_TABLE).split()
+    terms = sorted(
+        token for token in set(tokens) if len(token) > 1 and token not in STOPWORDS
+    )
+    lookup = dict.fromkeys(set(tokens), IGNORED)
+    lookup.update((token, term_id) for term_id, token in enumerate(terms))
+    lookup[SEPARATOR_TOKEN] = SEPARATOR
+    ids = np.fromiter(
+        map(lookup.__getitem__, tokens), dtype=np.int64, count=len(tokens)
+    )
+    text_ids = np.cumsum(ids == SEPARATOR)
+    mask = ids >= 0
+    return text_ids[mask], ids[mask], len(terms)
+
+
+def tfidf_similarity(documents: List[str], queries: List[str]) -> np.ndarray:
+    """
+    :return: for every document, the max cosine similarity between its tf-idf vector and that of any query.
+    idf is computed over the documents, and the sparse document-term matrix is kept as flat coordinate arrays
+    so that everything after tokenization is vectorized.
+    """
+    if len(documents) == 0 or len(queries) == 0:
+        return np.zeros(len(documents))
+    n_docs = len(documents)
+    text_ids, term_ids, vocab_size = tokenize_corpus(documents + queries)
+
+    # (text, term) -> count, as sorted unique coordinates
+    keys, counts = np.unique(text_ids * vocab_size + term_ids, return_counts=True)
+    rows = keys // vocab_size
+    cols = keys % vocab_size
+    is_doc = rows < n_docs
+
+    doc_freq = np.bincount(cols[is_doc], minlength=vocab_size)
+    idf = np.log((1.0 + n_docs) / (1.0 + doc_freq)) + 1.0
+    # sublinear tf damps long abstracts that repeat the same words
+    weights = (1.0 + np.log(counts)) * idf[cols]
+
+    query_matrix = np.zeros((len(queries), vocab_size))
+    query_matrix[rows[~is_doc] - n_docs, cols[~is_doc]] = weights[~is_doc]
+    query_norms = np.linalg.norm(query_matrix, axis=1)
+    query_norms[query_norms == 0] = 1.0
+    query_matrix /= query_norms[:, None]
+
+    rows, cols, weights = rows[is_doc], cols[is_doc], weights[is_doc]
+    doc_norms = np.sqrt(np.bincount(rows, weights=weights**2, minlength=n_docs))
+    doc_norms[doc_norms == 0] = 1.0
+    similarity = np.zeros((len(queries), n_docs))
+    for i in range(len(queries)):
+        similarity[i] = np.bincount(
+            rows, weights=weights * query_matrix[i, cols], minlength=n_docs
+        )
+    return similarity.max(axis=0) / doc_norms
+
+
+def filter_papers_locally(papers: List[Paper], criterion: str, config) -> List[Paper]:
+    # keeps papers above the similarity threshold (and at most the top k), in their original order
+    scores = tfidf_similarity(
+        [paper.title + " " + paper.abstract for paper in papers],
+        split_criteria(criterion),
+    )
+    keep = scores >= float(config["FILTERING"]["local_filter_threshold"])
+    top_k = int(config["FILTERING"]["local_filter_top_k"])
+    if 0 < top_k < int(keep.sum()):
+        # stable sort so that ties are broken by the original order
+        ranked = np.argsort(-scores, kind="stable")[:top_k]
+        keep = np.zeros(len(papers), dtype=bool)
+        keep[ranked] = True
+    if config["OUTPUT"].getboolean("debug_messages"):
+        for paper, score, kept in zip(papers, scores, keep):
+            if not kept:
+                print(
+                    "Filtered out paper " + paper.arxiv_id + " with score %.3f" % score
+                )
+    return [paper for paper, kept in zip(papers, keep) if kept]
@@ -1,24 +1,42 @@
 import json
 import configparser
 import os
-import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
 
-from openai import OpenAI
 from requests import Session
-from typing import TypeVar, Generator
+from requests.adapters import HTTPAdapter
+from typing import TypeVar, Generator, Tuple
 import io
 
-from retry import retry
 from tqdm import tqdm
 
-from arxiv_scraper import get_papers_from_arxiv_rss_api
-from filter_papers import filter_by_author, filter_by_gpt
-from parse_json_to_md import render_md_string
+from arxiv_scraper import FeedFetcher, Paper, get_papers_from_arxiv_rss_api
+from archive import PaperArchive
+from author_index import AuthorIndex
+from author_matching import AuthorMatcher, load_author_matcher
+from checkpoint import RunCheckpoint
+from disk_cache import DiskCache, MISSING
+from llm_backends import make_client
+from rate_limit import TokenBucket, request_with_backoff
+from telemetry import metrics
+from filter_papers import (
+    GPTScorer,
+    filter_by_author,
+    filter_by_gpt,
+    filter_papers_by_hindex,
+    merge_scored_batches,
+)
+from parse_json_to_md import MdSite, write_md
 from push_to_slack import push_to_slack
 from arxiv_scraper import EnhancedJSONEncoder
 
 T = TypeVar("T")
 
+S2_API_URL = "https://api.semanticscholar.org/graph/v1"
+
 
 def batched(items: list[T], batch_size: int) -> list[T]:
     # takes a list and returns a list of list with batch_size
@@ -36,6 +54,7 @@ def get_paper_batch(
     ids: list[str],
     S2_API_KEY: str,
     fields: str = "paperId,title",
+    limiter: TokenBucket = None,
     **kwargs,
 ) -> list[dict]:
     # gets a batch of papers. taken from the sem scholar example.
@@ -54,13 +73,16 @@ def get_paper_batch(
     }
 
     # https://api.semanticscholar.org/api-docs/graph#tag/Paper-Data/operation/post_graph_get_papers
-    with session.post(
-        "https://api.semanticscholar.org/graph/v1/paper/batch",
+    with request_with_backoff(
+        session,
+        "POST",
+        S2_API_URL + "/paper/batch",
+        limiter=limiter,
         params=params,
         headers=headers,
         json=body,
+        timeout=60,
     ) as response:
-        response.raise_for_status()
         return response.json()
 
 
@@ -69,6 +91,7 @@ def get_author_batch(
     ids: list[str],
     S2_API_KEY: str,
     fields: str = "name,hIndex,citationCount",
+    limiter: TokenBucket = None,
     **kwargs,
 ) -> list[dict]:
     # gets a batch of authors. analogous to author batch
@@ -86,18 +109,22 @@ def get_author_batch(
         "ids": ids,
     }
 
-    with session.post(
-        "https://api.semanticscholar.org/graph/v1/author/batch",
+    with request_with_backoff(
+        session,
+        "POST",
+        S2_API_URL + "/author/batch",
+        limiter=limiter,
         params=params,
         headers=headers,
         json=body,
+        timeout=60,
     ) as response:
-        response.raise_for_status()
         return response.json()
 
 
-@retry(tries=3, delay=2.0)
-def get_one_author(session, author: str, S2_API_KEY: str) -> str:
+def get_one_author(
+    session, author: str, S2_API_KEY: str, limiter: TokenBucket = None
+) -> list[dict]:
     # query the right endpoint https://api.semanticscholar.org/graph/v1/author/search?query=adam+smith
     params = {"query": author, "fields": "authorId,name,hIndex", "limit": "10"}
     if S2_API_KEY is None:
@@ -106,22 +133,18 @@ def get_one_author(session, author: str, S2_API_KEY: str) -> str:
         headers = {
             "X-API-KEY": S2_API_KEY,
         }
-    with session.get(
-        "https://api.semanticscholar.org/graph/v1/author/search",
+    # errors are raised after retrying, an empty list means no match
+    with request_with_backoff(
+        session,
+        "GET",
+        S2_API_URL + "/author/search",
+        limiter=limiter,
         params=params,
         headers=headers,
+        timeout=30,
     ) as response:
-        # try catch for errors
-        try:
-            response.raise_for_status()
-            response_json = response.json()
-            if len(response_json["data"]) >= 1:
-                return response_json["data"]
-            else:
-                return None
-        except Exception as ex:
-            print("exception happened" + str(ex))
-            return None
+        response_json = response.json()
+        return response_json["data"]
 
 
 def get_papers(
@@ -135,36 +158,572 @@ def get_papers(
             yield from get_paper_batch(session, ids_batch, S2_API_KEY, **kwargs)
 
 
+def open_author_cache(config):
+    # persistent cache for author lookups, so that daily runs only query new names
+    if not config["CACHE"].getboolean("author_cache"):
+        return None
+    day = 24 * 60 * 60
+    return DiskCache(
+        os.path.join(config["CACHE"]["cache_dir"], "authors.sqlite3"),
+        namespace="s2_author_search",
+        ttl=float(config["CACHE"]["author_ttl_days"]) * day,
+        max_entries=int(config["CACHE"]["author_max_entries"]),
+    )
+
+
+def make_session(pool_size: int) -> Session:
+    # a session whose connection pool is large enough to keep a connection open per worker
+    session = Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def s2_requests_per_second(config, S2_API_KEY: str) -> float:
+    if S2_API_KEY is None:
+        return float(config["S2"]["requests_per_second_without_key"])
+    return float(config["S2"]["requests_per_second_with_key"])
+
+
+def make_s2_client(config, S2_API_KEY: str) -> Tuple[TokenBucket, Session]:
+    # one rate limiter and connection pool shared by every semantic scholar request of a run
+    limiter = TokenBucket(s2_requests_per_second(config, S2_API_KEY))
+    return limiter, make_session(int(config["S2"]["max_in_flight"]))
+
+
+@metrics.span("get_authors")
 def get_authors(
-    all_authors: list[str], S2_API_KEY: str, batch_size: int = 100, **kwargs
+    all_authors: list[str],
+    S2_API_KEY: str,
+    limiter: TokenBucket,
+    session: Session,
+    batch_size: int = 100,
+    cache: DiskCache = None,
+    negative_ttl: float = None,
+    max_in_flight: int = 8,
+    **kwargs,
 ):
     # first get the list of all author ids by querying by author names
+    resolved = {}
+    to_query = []
+    for author in all_authors:
+        if cache is not None:
+            auth_map = cache.get(author)
+            if auth_map is not MISSING:
+                # a cached None means that we previously found no match for this name
+                if auth_map is not None:
+                    resolved[author] = auth_map
+                continue
+        to_query.append(author)
+
+    def lookup(author):
+        try:
+            return get_one_author(session, author, S2_API_KEY, limiter)
+        except Exception as ex:
+            print("exception happened" + str(ex))
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        results = executor.map(lookup, to_query)
+        for author, auth_map in tqdm(zip(to_query, results), total=len(to_query)):
+            if auth_map is None:
+                # do not cache failed lookups, they get retried on the next run
+                continue
+            if cache is not None:
+                if len(auth_map) > 0:
+                    cache.set(author, auth_map)
+                else:
+                    cache.set(author, None, ttl=negative_ttl)
+            if len(auth_map) > 0:
+                resolved[author] = auth_map
+    # keep the same ordering as the input list
+    author_metadata_dict = {
+        author: resolved[author] for author in all_authors if author in resolved
+    }
+    return author_metadata_dict
+
+
+def match_paper_authors(arxiv_authors: list[str], s2_authors: list[dict]) -> dict:
+    # maps arxiv author names to the semantic scholar author ids listed on the same paper
+    matches = {}
+    if len(arxiv_authors) == len(s2_authors):
+        # both lists are in byline order, so match them up by position
+        for name, s2_author in zip(arxiv_authors, s2_authors):
+            if s2_author.get("authorId") is not None:
+                matches[name] = s2_author["authorId"]
+        return matches
+    s2_ids_by_name = {
+        s2_author["name"].lower(): s2_author["authorId"]
+        for s2_author in s2_authors
+        if s2_author.get("authorId") is not None and s2_author.get("name")
+    }
+    for name in arxiv_authors:
+        if name.lower() in s2_ids_by_name:
+            matches[name] = s2_ids_by_name[name.lower()]
+    return matches
+
+
+@metrics.span("get_authors_from_papers")
+def get_authors_from_papers(
+    papers: list[Paper],
+    S2_API_KEY: str,
+    limiter: TokenBucket,
+    session: Session,
+    max_in_flight: int = 8,
+) -> dict:
+    """
+    Resolves authors in two phases of batch calls instead of one search per name.
+    1. look up the papers themselves by arxiv id to map each author name to a semantic scholar author id
+    2. hydrate the hIndex and citationCount of every author id with the author batch endpoint
+    Papers that semantic scholar has not indexed yet are skipped, so the result may be missing names.
+    :return: a dict in the same format as get_authors, name -> list of matching authors
+    """
+    paper_ids = [paper.arxiv_id for paper in papers]
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        # phase 1: arxiv id -> authors, at most 500 ids per call
+        paper_batches = executor.map(
+            lambda ids: get_paper_batch(
+                session,
+                ["ARXIV:" + arxiv_id for arxiv_id in ids],
+                S2_API_KEY,
+                fields="authors",
+                limiter=limiter,
+            ),
+            batched(paper_ids, 500),
+        )
+        name_to_ids = {}
+        for paper_batch, id_batch in zip(paper_batches, batched(papers, 500)):
+            for s2_paper, paper in zip(paper_batch, id_batch):
+                if s2_paper is None:
+                    continue
+                matches = match_paper_authors(paper.authors, s2_paper["authors"])
+                for name, author_id in matches.items():
+                    name_to_ids.setdefault(name, set()).add(author_id)
+
+        # phase 2: author id -> metadata, at most 1000 ids per call
+        unique_ids = sorted(set().union(*name_to_ids.values()))
+        author_batches = executor.map(
+            lambda ids: get_author_batch(
+                session,
+                ids,
+                S2_API_KEY,
+                fields="name,hIndex,citationCount",
+                limiter=limiter,
+            ),
+            batched(unique_ids, 1000),
+        )
+        authors_by_id = {}
+        for author_batch in author_batches:
+            for s2_author in author_batch:
+                if s2_author is not None and s2_author.get("hIndex") is not None:
+                    authors_by_id[s2_author["authorId"]] = s2_author
+
     author_metadata_dict = {}
-    with Session() as session:
-        for author in tqdm(all_authors):
-            auth_map = get_one_author(session, author, S2_API_KEY)
-            if auth_map is not None:
-                author_metadata_dict[author] = auth_map
-            # add a 20ms wait time to avoid rate limiting
-            # otherwise, semantic scholar aggressively rate limits, so do 1s
-            if S2_API_KEY is not None:
-                time.sleep(0.02)
-            else:
-                time.sleep(1.0)
+    for name, ids in name_to_ids.items():
+        aliases = [authors_by_id[i] for i in sorted(ids) if i in authors_by_id]
+        if len(aliases) > 0:
+            author_metadata_dict[name] = aliases
     return author_metadata_dict
 
 
-def get_papers_from_arxiv(config):
-    area_list = config["FILTERING"]["arxiv_category"].split(",")
+@metrics.span("resolve_authors")
+def resolve_authors(
+    papers: list[Paper],
+    S2_API_KEY: str,
+    config,
+    cache: DiskCache = None,
+    known_authors: dict = None,
+    matcher: AuthorMatcher = None,
+    limiter: TokenBucket = None,
+    session: Session = None,
+) -> dict:
+    # gets author metadata for every author of every paper (except known_authors), preferring the batch endpoints.
+    # callers resolving several chunks should pass the limiter and session from make_s2_client, so that
+    # the rate limit holds across chunks
+    if limiter is None or session is None:
+        limiter, session = make_s2_client(config, S2_API_KEY)
+        with session:
+            return lookup_authors(
+                papers,
+                S2_API_KEY,
+                config,
+                cache,
+                known_authors,
+                matcher,
+                limiter,
+                session,
+            )
+    return lookup_authors(
+        papers, S2_API_KEY, config, cache, known_authors, matcher, limiter, session
+    )
+
+
+def lookup_authors(
+    papers: list[Paper],
+    S2_API_KEY: str,
+    config,
+    cache: DiskCache,
+    known_authors: dict,
+    matcher: AuthorMatcher,
+    limiter: TokenBucket,
+    session: Session,
+) -> dict:
+    all_authors = set()
+    for paper in papers:
+        all_authors.update(set(paper.authors))
+    if known_authors is not None:
+        all_authors.difference_update(known_authors.keys())
+    if len(all_authors) == 0:
+        return {}
+    # names that fuzzy match a followed author get that author as an extra alias
+    tracked = {} if matcher is None else matcher.match_all(all_authors)
+    if config["OUTPUT"].getboolean("debug_messages") and len(tracked) > 0:
+        print("Matched followed authors by name: " + str(tracked))
+    if config["S2"].getboolean("skip_tracked_authors"):
+        # we already know who names matching on the full first name are, so don't spend requests on them.
+        # a bare initial and a surname could be anyone, so those still get looked up
+        all_authors.difference_update(
+            name
+            for name, matches in tracked.items()
+            if any(not match["initial_only"] for match in matches)
+        )
+    if config["OUTPUT"].getboolean("debug_messages"):
+        print("Getting author info for " + str(len(all_authors)) + " authors")
+    max_in_flight = int(config["S2"]["max_in_flight"])
+    resolved = {}
+    if config["S2"].getboolean("batch_author_lookup"):
+        try:
+            resolved = get_authors_from_papers(
+                papers, S2_API_KEY, limiter, session, max_in_flight
+            )
+            resolved = {
+                name: aliases
+                for name, aliases in resolved.items()
+                if name in all_authors
+            }
+        except Exception as ex:
+            # fall back to searching for every name
+            print("exception happened" + str(ex))
+            resolved = {}
+        if config["OUTPUT"].getboolean("debug_messages"):
+            print(
+                "Resolved "
+                + str(len(resolved))
+                + " authors via batch lookup, searching for the remaining "
+                + str(len(all_authors) - len(resolved))
+            )
+    # names on papers that semantic scholar has not indexed yet need a search by name
+    remaining = [author for author in all_authors if author not in resolved]
+    searched = get_authors(
+        remaining,
+        S2_API_KEY,
+        limiter,
+        session,
+        cache=cache,
+        negative_ttl=float(config["CACHE"]["author_negative_ttl_days"]) * 24 * 60 * 60,
+        max_in_flight=max_in_flight,
+    )
+    resolved = {**resolved, **searched}
+    for name, matches in tracked.items():
+        # initial only matches only count if semantic scholar confirmed them, in which case the lookup
+        # already returned the followed author
+        resolved_ids = {author.get("authorId") for author in resolved.get(name, [])}
+        confirmed = [
+            match
+            for match in matches
+            if not match["initial_only"] and match["authorId"] not in resolved_ids
+        ]
+        if len(confirmed) == 0:
+            continue
+        # hIndex is unknown without a lookup, these papers get selected by the author match anyway
+        resolved[name] = resolved.get(name, []) + [
+            {"authorId": match["authorId"], "name": match["name"], "hIndex": None}
+            for match in confirmed
+        ]
+    return resolved
+
+
+def iter_papers_from_arxiv(config, fetcher: FeedFetcher = None):
+    # yields chunks of new papers as the category feeds come in, skipping papers seen in earlier feeds.
+    # all feeds are requested at once, so fetching many categories takes about as long as the slowest one
+    area_list = [
+        area.strip() for area in config["FILTERING"]["arxiv_category"].split(",")
+    ]
+    chunk_size = int(config["PIPELINE"]["chunk_size"])
+    if fetcher is None:
+        fetcher = FeedFetcher(config)
+    # every feed is parsed while it downloads, and passes its papers on in chunks
+    feed_queues = [queue.Queue() for _ in area_list]
+
+    def read_feed(area, feed_queue):
+        try:
+            chunk = []
+            for paper in get_papers_from_arxiv_rss_api(area, config, fetcher):
+                chunk.append(paper)
+                if len(chunk) == chunk_size:
+                    feed_queue.put(chunk)
+                    chunk = []
+            feed_queue.put(chunk)
+            feed_queue.put(END_OF_STREAM)
+        except Exception as ex:
+            feed_queue.put(StageFailure(ex))
+
+    seen_ids = set()
+    with ThreadPoolExecutor(
+        max_workers=int(config["PIPELINE"]["max_feeds_in_flight"])
+    ) as executor:
+        for area, feed_queue in zip(area_list, feed_queues):
+            executor.submit(read_feed, area, feed_queue)
+        # feeds are read in category order, so deduplication does not depend on which feed arrives first
+        for feed_queue in feed_queues:
+            new_papers = []
+            for papers in iterate_queue(feed_queue):
+                for paper in papers:
+                    if paper.arxiv_id not in seen_ids:
+                        seen_ids.add(paper.arxiv_id)
+                        new_papers.append(paper)
+                while len(new_papers) >= chunk_size:
+                    yield new_papers[:chunk_size]
+                    new_papers = new_papers[chunk_size:]
+            if len(new_papers) > 0:
+                yield new_papers
+    if config["OUTPUT"].getboolean("debug_messages"):
+        fetcher.report()
+
+
+@metrics.span("get_papers_from_arxiv")
+def get_papers_from_arxiv(config, fetcher: FeedFetcher = None):
     paper_set = set()
-    for area in area_list:
-        papers = get_papers_from_arxiv_rss_api(area.strip(), config)
+    for papers in iter_papers_from_arxiv(config, fetcher):
         paper_set.update(set(papers))
     if config["OUTPUT"].getboolean("debug_messages"):
         print("Number of papers:" + str(len(paper_set)))
     return paper_set
 
 
+def run_pipeline(
+    config,
+    S2_API_KEY,
+    openai_client,
+    author_id_set,
+    author_cache,
+    fetcher=None,
+    scores=None,
+    matcher=None,
+    checkpoint: RunCheckpoint = None,
+):
+    # runs every stage to completion before starting the next one. stages an earlier attempt at the run
+    # checkpointed are loaded instead
+    papers = None if checkpoint is None else checkpoint.load_papers()
+    if papers is None:
+        papers = list(get_papers_from_arxiv(config, fetcher))
+        if checkpoint is not None:
+            checkpoint.save_papers(papers)
+    all_authors = None if checkpoint is None else checkpoint.load_authors()
+    if all_authors is None:
+        all_authors = resolve_authors(
+            papers, S2_API_KEY, config, cache=author_cache, matcher=matcher
+        )
+        if checkpoint is not None:
+            checkpoint.save_authors(all_authors)
+    index = AuthorIndex.build(all_authors, author_id_set)
+    selected_papers, all_papers, sort_dict = filter_by_author(
+        all_authors, papers, author_id_set, config, index
+    )
+    filter_by_gpt(
+        all_authors,
+        papers,
+        config,
+        openai_client,
+        all_papers,
+        selected_papers,
+        sort_dict,
+        scores,
+        index,
+        checkpoint,
+    )
+    return papers, all_authors, selected_papers, sort_dict
+
+
+# marks the end of the stream of items in a pipeline queue
+END_OF_STREAM = object()
+
+
+class StageFailure:
+    # passed down a pipeline queue when the stage producing it raised an exception
+    def __init__(self, exception: Exception):
+        self.exception = exception
+
+
+def start_stage(generator_fn, out_queue: queue.Queue) -> threading.Thread:
+    # runs a pipeline stage on its own thread. put blocks when the queue is full, which gives us backpressure
+    def run():
+        try:
+            for item in generator_fn():
+                out_queue.put(item)
+            out_queue.put(END_OF_STREAM)
+        except Exception as ex:
+            out_queue.put(StageFailure(ex))
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def iterate_queue(in_queue: queue.Queue):
+    while True:
+        item = in_queue.get()
+        if item is END_OF_STREAM:
+            return
+        if isinstance(item, StageFailure):
+            raise item.exception
+        yield item
+
+
+def run_streaming_pipeline(
+    config,
+    S2_API_KEY,
+    openai_client,
+    author_id_set,
+    author_cache,
+    fetcher=None,
+    scores=None,
+    matcher=None,
+    checkpoint: RunCheckpoint = None,
+):
+    """
+    Overlaps the network bound stages instead of running them one after another.
+    Papers flow from the arxiv feeds to author resolution in chunks as soon as a feed is parsed, and into
+    GPT batches as soon as their authors are known, so total time approaches that of the slowest stage.
+    Queues between the stages are bounded, so a slow stage holds back the ones in front of it.
+    """
+    queue_size = int(config["PIPELINE"]["queue_size"])
+    paper_queue = queue.Queue(maxsize=queue_size)
+    resolved_queue = queue.Queue(maxsize=queue_size)
+    all_authors = {}
+    # every name looked up so far, MISSING for the ones semantic scholar could not resolve
+    looked_up = {}
+    # chunks resolved back to back share one rate limit and keep their connections open
+    limiter, session = make_s2_client(config, S2_API_KEY)
+
+    def resolve_chunks():
+        with session:
+            for chunk in iterate_queue(paper_queue):
+                # only the names we have not seen in earlier chunks need a lookup, resolved or not
+                new_authors = resolve_authors(
+                    chunk,
+                    S2_API_KEY,
+                    config,
+                    author_cache,
+                    known_authors=looked_up,
+                    matcher=matcher,
+                    limiter=limiter,
+                    session=session,
+                )
+                all_authors.update(new_authors)
+                for paper in chunk:
+                    for author in paper.authors:
+                        looked_up[author] = all_authors.get(author, MISSING)
+                yield chunk
+
+    start_stage(lambda: iter_papers_from_arxiv(config, fetcher), paper_queue)
+    start_stage(resolve_chunks, resolved_queue)
+
+    papers = []
+    selected_papers, all_papers, sort_dict = {}, {}, {}
+    index = AuthorIndex(author_id_set)
+
+    def filter_chunk_by_author(chunk):
+        # the authors of a chunk are resolved before it is handed to us, so only index those
+        index.update(
+            {
+                author: all_authors[author]
+                for paper in chunk
+                for author in paper.authors
+                if author in all_authors
+            }
+        )
+        for results, chunk_results in zip(
+            [selected_papers, all_papers, sort_dict],
+            filter_by_author(all_authors, chunk, author_id_set, config, index),
+        ):
+            results.update(chunk_results)
+
+    def checkpoint_inputs():
+        # both upstream stages are done once the resolved queue runs dry
+        if checkpoint is not None:
+            checkpoint.save_papers(papers)
+            checkpoint.save_authors(all_authors)
+
+    if not config["SELECTION"].getboolean("run_openai"):
+        for chunk in iterate_queue(resolved_queue):
+            papers.extend(chunk)
+            filter_chunk_by_author(chunk)
+        checkpoint_inputs()
+        return papers, all_authors, selected_papers, sort_dict
+
+    scorer = GPTScorer(config, openai_client, checkpoint)
+    stored_results = []
+    futures = []
+    pending = []
+    # in batch scoring_mode the batches are collected and submitted as one batch job at the end
+    offline_batches = []
+    all_cost = 0
+    # the title filter ranks titles against each other (top k, idf) and fills its own batches, so it runs once
+    # over every paper of the run instead of once per chunk
+    filter_titles = config["FILTERING"]["title_filter"] != "none"
+    unfiltered = []
+    with ThreadPoolExecutor(max_workers=scorer.max_in_flight) as executor:
+
+        def submit(batches):
+            for batch in batches:
+                if scorer.scoring_mode == "batch":
+                    offline_batches.append(batch)
+                else:
+                    futures.append(executor.submit(scorer.score_batch, batch))
+
+        try:
+            for chunk in iterate_queue(resolved_queue):
+                papers.extend(chunk)
+                filter_chunk_by_author(chunk)
+                paper_list = filter_papers_by_hindex(all_authors, chunk, config, index)
+                stored_dicts, paper_list = scorer.split_stored(paper_list)
+                if len(stored_dicts) > 0:
+                    stored_results.append((stored_dicts, 0))
+                if filter_titles:
+                    unfiltered.extend(paper_list)
+                    continue
+                batches = scorer.make_batches(pending + paper_list)
+                # hold on to the last, possibly partial batch until more papers arrive
+                pending = batches.pop() if len(batches) > 0 else []
+                submit(batches)
+            checkpoint_inputs()
+            if filter_titles:
+                pending, cost = scorer.filter_titles(unfiltered)
+                all_cost += cost
+            submit(scorer.make_batches(pending))
+            # merge in submission order so that the output does not depend on timing
+            batch_results = stored_results + [
+                future.result() for future in tqdm(futures)
+            ]
+            if len(offline_batches) > 0:
+                batch_results += scorer.score_batches(offline_batches)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+        finally:
+            scorer.close()
+    all_cost += merge_scored_batches(
+        batch_results, config, all_papers, selected_papers, sort_dict, scores
+    )
+    if config["OUTPUT"].getboolean("debug_messages"):
+        print("Number of papers:" + str(len(papers)))
+        print("Total cost: $" + str(all_cost))
+    return papers, all_authors, selected_papers, sort_dict
+
+
 def parse_authors(lines):
     # parse the comma-separated author list, ignoring lines that are empty and starting with #
     author_ids = []
@@ -186,27 +745,65 @@ if __name__ == "__main__":
     config.read("configs/config.ini")
 
     S2_API_KEY = os.environ.get("S2_KEY")
-    OAI_KEY = os.environ.get("OAI_KEY")
-    if OAI_KEY is None:
-        raise ValueError(
-            "OpenAI key is not set - please set OAI_KEY to your OpenAI key"
-        )
-    openai_client = OpenAI(api_key=OAI_KEY)
+    # created up front so that a missing OAI_KEY fails before anything is fetched. clients of the
+    # other backends are created from their [LLM <name>] sections when scoring starts
+    openai_client = None
+    if "openai" in [
+        config["LLM"]["scoring_backend"],
+        config["LLM"]["title_filter_backend"],
+    ]:
+        openai_client = make_client(config, "openai")
     # load the author list
     with io.open("configs/authors.txt", "r") as fopen:
         author_names, author_ids = parse_authors(fopen.readlines())
     author_id_set = set(author_ids)
+    matcher = load_author_matcher(config, author_names, author_ids)
 
-    papers = list(get_papers_from_arxiv(config))
-    # dump all papers for debugging
-
-    all_authors = set()
-    for paper in papers:
-        all_authors.update(set(paper.authors))
-    if config["OUTPUT"].getboolean("debug_messages"):
-        print("Getting author info for " + str(len(all_authors)) + " authors")
-    all_authors = get_authors(list(all_authors), S2_API_KEY)
+    author_cache = open_author_cache(config)
+    fetcher = FeedFetcher(
+        config, pool_size=int(config["PIPELINE"]["max_feeds_in_flight"])
+    )
+    # gpt scores of every scored paper, for the archive
+    scores = {}
+    checkpoint = RunCheckpoint.open(config)
+    # an earlier attempt at today's run got past fetching and resolving authors, so there is nothing to overlap
+    resuming = checkpoint is not None and checkpoint.has("authors")
+    if resuming and config["OUTPUT"].getboolean("debug_messages"):
+        print("Resuming the run checkpointed in " + checkpoint.state_dir)
+    with metrics.span("pipeline"):
+        if config["PIPELINE"].getboolean("streaming") and not resuming:
+            papers, all_authors, selected_papers, sort_dict = run_streaming_pipeline(
+                config,
+                S2_API_KEY,
+                openai_client,
+                author_id_set,
+                author_cache,
+                fetcher,
+                scores,
+                matcher,
+                checkpoint,
+            )
+        else:
+            papers, all_authors, selected_papers, sort_dict = run_pipeline(
+                config,
+                S2_API_KEY,
+                openai_client,
+                author_id_set,
+                author_cache,
+                fetcher,
+                scores,
+                matcher,
+                checkpoint,
+            )
+    metrics.count("papers", len(papers))
+    metrics.count("papers_selected", len(selected_papers))
+    if author_cache is not None:
+        metrics.attach("author_cache", author_cache.stats())
+        if config["OUTPUT"].getboolean("debug_messages"):
+            print("Author cache stats: " + str(author_cache.stats()))
+        author_cache.close()
 
+    # dump all papers for debugging
     if config["OUTPUT"].getboolean("dump_debug_file"):
         with open(
             config["OUTPUT"]["output_path"] + "papers.debug.json", "w"
@@ -221,19 +818,6 @@ if __name__ == "__main__":
         ) as outfile:
             json.dump(list(author_id_set), outfile, cls=EnhancedJSONEncoder, indent=4)
 
-    selected_papers, all_papers, sort_dict = filter_by_author(
-        all_authors, papers, author_id_set, config
-    )
-    filter_by_gpt(
-        all_authors,
-        papers,
-        config,
-        openai_client,
-        all_papers,
-        selected_papers,
-        sort_dict,
-    )
-
     # sort the papers by relevance and novelty
     keys = list(sort_dict.keys())
     values = list(sort_dict.values())
@@ -245,12 +829,17 @@ if __name__ == "__main__":
 
     # pick endpoints and push the summaries
     if len(papers) > 0:
-        if config["OUTPUT"].getboolean("dump_json"):
-            with open(config["OUTPUT"]["output_path"] + "output.json", "w") as outfile:
-                json.dump(selected_papers, outfile, indent=4)
-        if config["OUTPUT"].getboolean("dump_md"):
-            with open(config["OUTPUT"]["output_path"] + "output.md", "w") as f:
-                f.write(render_md_string(selected_papers))
+        with metrics.span("write_outputs"):
+            if config["OUTPUT"].getboolean("dump_json"):
+                with open(
+                    config["OUTPUT"]["output_path"] + "output.json", "w"
+                ) as outfile:
+                    json.dump(selected_papers, outfile, indent=4)
+            if config["OUTPUT"].getboolean("dump_md"):
+                with open(config["OUTPUT"]["output_path"] + "output.md", "w") as f:
+                    write_md(selected_papers, f)
+            if config["OUTPUT"].getboolean("dump_md_site"):
+                MdSite(config["OUTPUT"]["md_site_dir"]).publish_day(selected_papers)
         # only push to slack for non-empty dicts
         if config["OUTPUT"].getboolean("push_to_slack"):
             SLACK_KEY = os.environ.get("SLACK_KEY")
@@ -259,4 +848,16 @@ if __name__ == "__main__":
                     "Warning: push_to_slack is true, but SLACK_KEY is not set - not pushing to slack"
                 )
             else:
-                push_to_slack(selected_papers)
+                with metrics.span("push_to_slack"):
+                    push_to_slack(selected_papers)
+    if config["ARCHIVE"].getboolean("archive") and len(papers) > 0:
+        with metrics.span("archive"):
+            PaperArchive(config["ARCHIVE"]["archive_dir"]).write_day(
+                date.today(), papers, scores, selected_papers
+            )
+    # only remember the feed validators once the day's papers have made it to the outputs
+    fetcher.commit()
+    fetcher.close()
+    if checkpoint is not None:
+        checkpoint.finish()
+    metrics.write(config)
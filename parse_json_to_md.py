@@ -1,5 +1,27 @@
+"""
+Renders the selected papers as markdown. Documents are written to the output file section by section instead of
+being built in memory, and MdSite keeps a multi-day site of them (index page, a page per month and a page per day)
+that only renders the new day's page on each run, so publishing takes the same time however long the history gets.
+"""
+
+import io
 import json
-from datetime import datetime
+import os
+from datetime import date
+
+TOPICS_PATH = "configs/paper_topics.txt"
+DAY_FORMAT = "%Y-%m-%d"
+# path -> modification time and contents of the files read so far
+text_cache = {}
+
+
+def read_text(path: str) -> str:
+    # only reads the file again once it has changed
+    mtime = os.path.getmtime(path)
+    if path not in text_cache or text_cache[path][0] != mtime:
+        with open(path, "r") as f:
+            text_cache[path] = (mtime, f.read())
+    return text_cache[path][1]
 
 
 def render_paper(paper_entry: dict, idx: int) -> str:
@@ -20,7 +42,7 @@ def render_paper(paper_entry: dict, idx: int) -> str:
     authors = paper_entry["authors"]
     paper_string = f'## {idx}. [{title}]({arxiv_url}) <a id="link{idx}"></a>\n'
     paper_string += f"**ArXiv ID:** {arxiv_id}\n"
-    paper_string += f'**Authors:** {", ".join(authors)}\n\n'
+    paper_string += f"**Authors:** {', '.join(authors)}\n\n"
     paper_string += f"**Abstract:** {abstract}\n\n"
     if "COMMENT" in paper_entry:
         comment = paper_entry["COMMENT"]
@@ -31,6 +53,8 @@ def render_paper(paper_entry: dict, idx: int) -> str:
         novelty = paper_entry["NOVELTY"]
         paper_string += f"**Relevance:** {relevance}\n"
         paper_string += f"**Novelty:** {novelty}\n"
+    if paper_entry.get("DISAGREEMENT"):
+        paper_string += "**Note:** the sampled scores for this paper disagree\n"
     return paper_string + "\n---\n"
 
 
@@ -38,37 +62,110 @@ def render_title_and_author(paper_entry: dict, idx: int) -> str:
     title = paper_entry["title"]
     authors = paper_entry["authors"]
     paper_string = f"{idx}. [{title}](#link{idx})\n"
-    paper_string += f'**Authors:** {", ".join(authors)}\n'
+    paper_string += f"**Authors:** {', '.join(authors)}\n"
     return paper_string
 
 
-def render_md_string(papers_dict):
+def write_md(papers_dict, f, day: date = None):
+    """
+    Writes the markdown document of the selected papers to f one section at a time.
+    :param papers_dict: the selected papers, in the order they are shown
+    :param f: a text file object to write to
+    :param day: the date in the header, today by default
+    """
+    day = day or date.today()
     # header
-    with open("configs/paper_topics.txt", "r") as f:
-        criterion = f.read()
-    output_string = (
+    f.write(
         "# Personalized Daily Arxiv Papers "
-        + datetime.today().strftime("%m/%d/%Y")
+        + day.strftime("%m/%d/%Y")
         + "\nTotal relevant papers: "
         + str(len(papers_dict))
         + "\n\n"
         + "Paper selection prompt and criteria at the bottom\n\n"
         + "Table of contents with paper titles:\n\n"
     )
-    title_strings = [
-        render_title_and_author(paper, i)
-        for i, paper in enumerate(papers_dict.values())
-    ]
-    output_string = output_string + "\n".join(title_strings) + "\n---\n"
+    for i, paper in enumerate(papers_dict.values()):
+        if i > 0:
+            f.write("\n")
+        f.write(render_title_and_author(paper, i))
+    f.write("\n---\n")
     # render each paper
-    paper_strings = [
-        render_paper(paper, i) for i, paper in enumerate(papers_dict.values())
-    ]
-    # join all papers into one string
-    output_string = output_string + "\n".join(paper_strings)
-    output_string += "\n\n---\n\n"
-    output_string += f"## Paper selection prompt\n{criterion}"
-    return output_string
+    for i, paper in enumerate(papers_dict.values()):
+        if i > 0:
+            f.write("\n")
+        f.write(render_paper(paper, i))
+    f.write("\n\n---\n\n")
+    f.write(f"## Paper selection prompt\n{read_text(TOPICS_PATH)}")
+
+
+def render_md_string(papers_dict, day: date = None) -> str:
+    output = io.StringIO()
+    write_md(papers_dict, output, day)
+    return output.getvalue()
+
+
+class MdSite:
+    def __init__(self, site_dir: str):
+        self.site_dir = site_dir
+        os.makedirs(os.path.join(site_dir, "days"), exist_ok=True)
+        os.makedirs(os.path.join(site_dir, "months"), exist_ok=True)
+
+    def publish_day(self, papers_dict, day: date = None):
+        """
+        Writes the page of the day, lists it on the page of its month and updates the index. Pages of earlier
+        days are left as they are, and publishing the same day again replaces its page.
+        """
+        day = day or date.today()
+        day_name = day.strftime(DAY_FORMAT)
+        day_path = os.path.join(self.site_dir, "days", day_name + ".md")
+        new_day = not os.path.exists(day_path)
+        # write to a temporary file first so that a crash never leaves a half written page behind
+        with open(day_path + ".tmp", "w") as f:
+            f.write("[All days](../index.md)\n\n")
+            write_md(papers_dict, f, day)
+        os.replace(day_path + ".tmp", day_path)
+        month_path = os.path.join(
+            self.site_dir, "months", day.strftime("%Y-%m") + ".md"
+        )
+        day_link = f"- [{day.strftime('%m/%d/%Y')}](../days/{day_name}.md): "
+        day_line = day_link + f"{len(papers_dict)} papers\n"
+        if new_day:
+            new_month = not os.path.exists(month_path)
+            with open(month_path, "a") as f:
+                if new_month:
+                    f.write(
+                        "# Personalized Daily Arxiv Papers of "
+                        + day.strftime("%B %Y")
+                        + "\n\n[All months](../index.md)\n\n"
+                    )
+                f.write(day_line)
+        else:
+            # the day is already listed, so only its paper count changes. a month page has at most 31 days
+            with open(month_path, "r") as f:
+                lines = f.readlines()
+            with open(month_path + ".tmp", "w") as f:
+                for line in lines:
+                    f.write(day_line if line.startswith(day_link) else line)
+            os.replace(month_path + ".tmp", month_path)
+        self.write_index(day)
+
+    def write_index(self, latest: date):
+        # the index links the latest day and every month, so it grows by one line a month
+        months = sorted(os.listdir(os.path.join(self.site_dir, "months")), reverse=True)
+        index_path = os.path.join(self.site_dir, "index.md")
+        with open(index_path + ".tmp", "w") as f:
+            f.write("# Personalized Daily Arxiv Papers\n\n")
+            f.write(
+                f"Latest: [{latest.strftime('%m/%d/%Y')}]"
+                f"(days/{latest.strftime(DAY_FORMAT)}.md)\n\n"
+            )
+            f.write("## Archive\n\n")
+            for name in months:
+                if not name.endswith(".md"):
+                    continue
+                month = date.fromisoformat(name[: -len(".md")] + "-01")
+                f.write(f"- [{month.strftime('%B %Y')}](months/{name})\n")
+        os.replace(index_path + ".tmp", index_path)
 
 
 if __name__ == "__main__":
@@ -77,4 +174,4 @@ if __name__ == "__main__":
         output = json.load(f)
     # write to output.md
     with open("out/output.md", "w") as f:
-        f.write(render_md_string(output))
+        write_md(output, f)
@@ -0,0 +1,49 @@
+"""
+Assembles the prompts of the title filter and the scoring stage so that providers with prompt caching can reuse
+as much of them as possible. Everything that is the same for every batch comes first: the byte-identical prefix
+shared by both stages (base prompt and criteria), then the stage's own instructions and output format, and only
+then the papers of the batch. Providers cache prompts by prefix, so every batch after the first only pays full
+price for its papers.
+"""
+
+from typing import List
+
+from score_parser import JSON_POSTFIX
+
+TITLE_FILTER_POSTFIX = 'Identify any papers that are absolutely and completely irrelavent to the criteria, and you are absolutely sure your friend will not enjoy, formatted as a list of arxiv ids like ["ID1", "ID2", "ID3"..]. Be extremely cautious, and if you are unsure at all, do not add a paper in this list. You will check it in detail later.\n Directly respond with the list, do not add ANY extra text before or after the list. Even if every paper seems irrelevant, please keep at least TWO papers'
+PAPERS_HEADER = "Papers:\n\n"
+
+
+class PromptLayout:
+    def __init__(
+        self, base_prompt: str, criterion: str, postfix_prompt: str, json_mode=False
+    ):
+        """
+        :param json_mode: ask for the scores as a JSON object instead of JSONL
+        """
+        # shared by both stages
+        self.prefix = base_prompt.strip() + "\n\n" + criterion.strip() + "\n\n"
+        scoring_instructions = postfix_prompt.strip()
+        if json_mode:
+            # JSON mode can't return JSONL, so ask for the records wrapped in an object
+            scoring_instructions += "\n" + JSON_POSTFIX
+        self.scoring_prefix = (
+            self.prefix + scoring_instructions + "\n\n" + PAPERS_HEADER
+        )
+        self.title_prefix = self.prefix + TITLE_FILTER_POSTFIX + "\n\n" + PAPERS_HEADER
+
+    @classmethod
+    def from_config_files(cls, json_mode=False):
+        with open("configs/base_prompt.txt", "r") as f:
+            base_prompt = f.read()
+        with open("configs/paper_topics.txt", "r") as f:
+            criterion = f.read()
+        with open("configs/postfix_prompt.txt", "r") as f:
+            postfix_prompt = f.read()
+        return cls(base_prompt, criterion, postfix_prompt, json_mode)
+
+    def scoring_prompt(self, paper_strings: List[str]) -> str:
+        return self.scoring_prefix + "\n\n".join(paper_strings) + "\n"
+
+    def title_prompt(self, title_strings: List[str]) -> str:
+        return self.title_prefix + "".join(title_strings)
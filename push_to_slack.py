@@ -10,6 +10,7 @@ from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
 
 from arxiv_scraper import Paper
+from telemetry import metrics
 
 T = TypeVar("T")
 
@@ -21,6 +22,7 @@ def batched(items: list[T], batch_size: int) -> list[T]:
 
 def send_main_message(block_list: List, channel_id, client):
     try:
+        metrics.count("slack_messages")
         # Call the conversations.list method using the WebClient
         result = client.chat_postMessage(
             channel=channel_id,
@@ -42,6 +44,7 @@ def send_thread(block_list: List, channel_id, thread_id, client):
         batches = batched(block_list, 50)
         # Call the conversations.list method using the WebClient
         for batch in batches:
+            metrics.count("slack_messages")
             result = client.chat_postMessage(
                 thread_ts=thread_id,
                 text="Arxiv full update",
@@ -83,7 +86,7 @@ def render_paper(paper_entry: Paper, counter: int) -> str:
         + title.replace("&", "&amp;")
         + "*>\n"
     )
-    paper_string += f'*Authors*: {", ".join(authors)}\n\n'
+    paper_string += f"*Authors*: {', '.join(authors)}\n\n"
     paper_string += f"*Abstract*: {abstract}\n\n"
     if "RELEVANCE" in paper_entry and "NOVELTY" in paper_entry:
         # get the relevance and novelty scores
@@ -122,7 +125,7 @@ def render_title(paper_entry: Paper, counter: int) -> str:
         + title.replace("&", "&amp;")
         + "*>\n"
     )
-    paper_string += f'*Authors*: {", ".join(authors)}\n\n'
+    paper_string += f"*Authors*: {', '.join(authors)}\n\n"
     return paper_string
 
 
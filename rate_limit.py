@@ -0,0 +1,142 @@
+"""
+Helpers for talking to rate limited APIs: a thread-safe token bucket, jittered exponential backoff
+and a requests wrapper that honors 429 Retry-After headers.
+"""
+
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+from urllib.parse import urlparse
+
+import requests
+
+from telemetry import metrics
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = None):
+        """
+        :param rate: tokens added per second
+        :param capacity: max number of tokens that can be saved up for a burst, defaults to one second worth
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0):
+        # blocks until `tokens` tokens are available. requests larger than the bucket only wait for a full bucket
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._tokens = min(
+                        self.capacity, self._tokens + (now - self._last) * self.rate
+                    )
+                    self._last = now
+                    if self._tokens >= tokens:
+                        self._tokens -= tokens
+                        return
+                    wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        # stop handing out tokens for a while, e.g. when the server asks us to back off
+        with self._lock:
+            until = time.monotonic() + seconds
+            if until > self._paused_until:
+                self._paused_until = until
+                self._last = until
+                self._tokens = 0.0
+
+
+def backoff_delay(attempt: int, base_delay: float = 1.0, max_delay: float = 60.0):
+    # exponential backoff with full jitter
+    return random.uniform(0, min(max_delay, base_delay * (2**attempt)))
+
+
+def retry_after_seconds(headers) -> Optional[float]:
+    # parses a Retry-After header, which is either a number of seconds or an http date
+    value = headers.get("Retry-After") if headers is not None else None
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def is_retryable_status(status_code: int) -> bool:
+    return status_code == 429 or status_code >= 500
+
+
+def request_with_backoff(
+    session: requests.Session,
+    method: str,
+    url: str,
+    limiter: TokenBucket = None,
+    max_retries: int = 5,
+    base_delay: float = 1.0,
+    max_delay: float = 60.0,
+    **kwargs,
+) -> requests.Response:
+    # sends a request through the rate limiter, retrying on 429s, server errors and connection problems
+    host = urlparse(url).hostname
+    for attempt in range(max_retries + 1):
+        if limiter is not None:
+            limiter.acquire()
+        if attempt > 0:
+            metrics.count("http_retries", host=host)
+        metrics.count("http_requests", host=host)
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == max_retries:
+                raise
+            time.sleep(backoff_delay(attempt, base_delay, max_delay))
+            continue
+        if is_retryable_status(response.status_code) and attempt < max_retries:
+            delay = retry_after_seconds(response.headers)
+            if delay is None:
+                delay = backoff_delay(attempt, base_delay, max_delay)
+            elif limiter is not None:
+                # the server told us how long to wait, so hold off all the other workers too
+                limiter.pause(delay)
+            response.close()
+            time.sleep(delay)
+            continue
+        if not response.ok:
+            # release the connection of a streamed response before giving up on it
+            response.close()
+            response.raise_for_status()
+        return response
+
+
+class MinuteRateLimiter:
+    # combined requests-per-minute and tokens-per-minute limits, as used by the openai api
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.requests = TokenBucket(
+            requests_per_minute / 60.0, capacity=requests_per_minute
+        )
+        self.tokens = TokenBucket(tokens_per_minute / 60.0, capacity=tokens_per_minute)
+
+    def acquire(self, tokens: float):
+        self.requests.acquire(1)
+        self.tokens.acquire(tokens)
+
+    def pause(self, seconds: float):
+        self.requests.pause(seconds)
+        self.tokens.pause(seconds)
@@ -0,0 +1,125 @@
+"""
+A streaming parser for the arxiv rss feeds. feedparser builds a dict tree for the whole feed (and sanitizes every
+field) before we look at a single entry, which dominates the time spent on large feeds and backfills.
+This parser walks the xml incrementally, normalizes each entry with precompiled patterns and yields papers
+one at a time, throwing away each item element once it has been read. It can be fed the body of the http response
+chunk by chunk, so papers come out while the feed is still downloading and the feed is never held in memory.
+"""
+
+import re
+from datetime import datetime
+from html import unescape
+from typing import Iterator, List, Optional
+from xml.etree.ElementTree import XMLPullParser
+
+from arxiv_scraper import Paper
+
+ARXIV_NS = "{http://arxiv.org/schemas/atom}"
+DC_NS = "{http://purl.org/dc/elements/1.1/}"
+HTML_TAG = re.compile("<[^<]+?>")
+NEWLINE = re.compile("\n")
+# the old feed format appended (arXiv:xxxx.xxxxx [area.XX]) to the title
+TITLE_SUFFIX = re.compile(r"\(arXiv:[0-9]+\.[0-9]+v[0-9]+ \[.*\]\)$")
+AUTHOR_SEPARATOR = re.compile("[\n,]")
+TIMESTAMP_FORMAT = "%a, %d %b %Y %H:%M:%S +0000"
+# bytes read at a time from file objects
+READ_SIZE = 64 * 1024
+
+
+def normalize_authors(creator: str) -> List[str]:
+    # strip html tags and entities from the comma separated author field
+    return [
+        unescape(HTML_TAG.sub("", author)).strip()
+        for author in AUTHOR_SEPARATOR.split(creator)
+    ]
+
+
+def normalize_summary(description: str) -> str:
+    return unescape(NEWLINE.sub(" ", HTML_TAG.sub("", description)))
+
+
+def normalize_title(title: str) -> str:
+    return TITLE_SUFFIX.sub("", title)
+
+
+def read_chunks(source) -> Iterator[bytes]:
+    # the feed as byte chunks, from bytes, a binary file object or an iterable of chunks
+    if isinstance(source, bytes):
+        yield source
+    elif hasattr(source, "read"):
+        yield from iter(lambda: source.read(READ_SIZE), b"")
+    else:
+        yield from source
+
+
+class FeedReader:
+    """
+    Iterating over a FeedReader yields the new papers of a feed. The channel's update time and the id of the
+    first entry (which the arxiv api fallback uses as a watermark) are filled in as the feed is read.
+    """
+
+    def __init__(self, source, area: str, force_primary: bool = False):
+        """
+        :param source: the feed as bytes, a binary file object or an iterable of byte chunks, e.g. the body of a
+        streamed http response
+        :param area: the category the feed belongs to
+        :param force_primary: skip papers that are only cross-listed in this category
+        """
+        self.source = source
+        self.area = area
+        self.force_primary = force_primary
+        self.timestamp: Optional[datetime] = None
+        self.last_id: Optional[str] = None
+        self.num_entries = 0
+
+    def __iter__(self) -> Iterator[Paper]:
+        parser = XMLPullParser(events=("end",))
+        for chunk in read_chunks(self.source):
+            parser.feed(chunk)
+            yield from self.read_events(parser)
+        parser.close()
+        yield from self.read_events(parser)
+
+    def read_events(self, parser: XMLPullParser) -> Iterator[Paper]:
+        # the papers of the elements completed by the chunks fed so far
+        for _, element in parser.read_events():
+            if element.tag == "item":
+                paper = self.read_item(element)
+                # items are not needed once read, so keep memory flat on big feeds
+                element.clear()
+                if paper is not None:
+                    yield paper
+            elif element.tag == "lastBuildDate" and element.text:
+                self.timestamp = datetime.strptime(
+                    element.text.strip(), TIMESTAMP_FORMAT
+                )
+
+    def read_item(self, item) -> Optional[Paper]:
+        self.num_entries += 1
+        link = item.findtext("link", "").strip()
+        if self.last_id is None:
+            self.last_id = link.split("/")[-1]
+        # ignore updated papers
+        if item.findtext(ARXIV_NS + "announce_type", "").strip() != "new":
+            return None
+        title = item.findtext("title", "").strip()
+        # ignore papers not in primary area
+        if self.force_primary and item.findtext("category", "").strip() != self.area:
+            print(f"ignoring {title}")
+            return None
+        return Paper(
+            authors=normalize_authors(item.findtext(DC_NS + "creator", "")),
+            title=normalize_title(title),
+            abstract=normalize_summary(item.findtext("description", "")),
+            arxiv_id=link.split("/")[-1],
+        )
+
+
+def parse_feed(source, area: str, force_primary: bool = False):
+    # same return values as get_papers_from_arxiv_rss: the new papers, the feed's update time and the newest id
+    reader = FeedReader(source, area, force_primary)
+    paper_list = list(reader)
+    if reader.num_entries == 0:
+        print("No entries found for " + area)
+        return [], None, None
+    return paper_list, reader.timestamp, reader.last_id
@@ -0,0 +1,205 @@
+"""
+Parsing of the model's paper scores. The parser is incremental: text can be fed in as it streams in, and every
+score record is returned as soon as its closing brace arrives. It picks the records out of JSONL, a JSON object
+({"papers": [...]}, as requested in JSON mode) or either of them wrapped in markdown, so one malformed record
+only costs that paper instead of everything after it.
+"""
+
+import json
+import re
+import threading
+from typing import List
+
+# trailing commas are the most common way models break otherwise valid records
+TRAILING_COMMA = re.compile(r",\s*([}\]])")
+# anything that could be an arxiv id, old style ids included
+ID_TOKEN = re.compile(r"[\w./-]+")
+
+# schema of the scores for backends that support structured outputs
+SCORE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "papers": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "ARXIVID": {"type": "string"},
+                    "COMMENT": {"type": "string"},
+                    "RELEVANCE": {"type": "integer"},
+                    "NOVELTY": {"type": "integer"},
+                },
+                "required": ["ARXIVID", "COMMENT", "RELEVANCE", "NOVELTY"],
+                "additionalProperties": False,
+            },
+        }
+    },
+    "required": ["papers"],
+    "additionalProperties": False,
+}
+JSON_POSTFIX = 'Respond with a JSON object of the form {"papers": [...]} with one entry with the keys ARXIVID, COMMENT, RELEVANCE and NOVELTY for each paper.'
+
+
+def response_format_for(mode: str):
+    # the response_format request parameter for the text, json_object and json_schema modes
+    if mode == "text":
+        return None
+    if mode == "json_object":
+        return {"type": "json_object"}
+    if mode == "json_schema":
+        return {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "paper_scores",
+                "schema": SCORE_SCHEMA,
+                "strict": True,
+            },
+        }
+    raise ValueError("Unknown response_format " + mode)
+
+
+def normalize_record(record) -> dict:
+    # checks that the record is a usable score and converts the scores to numbers, None if it is not
+    if not isinstance(record, dict) or not isinstance(record.get("ARXIVID"), str):
+        return None
+    try:
+        for key in ["RELEVANCE", "NOVELTY"]:
+            score = float(record[key])
+            record[key] = int(score) if score.is_integer() else score
+    except (KeyError, TypeError, ValueError):
+        return None
+    return record
+
+
+class ScoreRecordParser:
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        # start offsets of the objects that are still open
+        self.open_objects = []
+        self.in_string = False
+        self.escaped = False
+        # depth of the innermost object that produced a record, its parents are not parsed again
+        self.record_depth = None
+        self.parsed = 0
+        self.failed = 0
+        # every record completed so far
+        self.records = []
+
+    def feed(self, text: str) -> List[dict]:
+        # returns the records completed by text
+        self.buffer += text
+        records = []
+        for i in range(self.pos, len(self.buffer)):
+            char = self.buffer[i]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == "{":
+                self.open_objects.append(i)
+            elif char == "}" and len(self.open_objects) > 0:
+                start = self.open_objects.pop()
+                depth = len(self.open_objects)
+                if self.record_depth is not None and depth < self.record_depth:
+                    # a wrapper around records, e.g. {"papers": [...]}
+                    continue
+                record = self.parse_object(self.buffer[start : i + 1])
+                if record is not None:
+                    self.record_depth = depth
+                    records.append(record)
+        self.pos = len(self.buffer)
+        self.records.extend(records)
+        return records
+
+    def parse_object(self, text: str):
+        try:
+            record = json.loads(text)
+        except ValueError:
+            try:
+                record = json.loads(TRAILING_COMMA.sub(r"\1", text))
+            except ValueError:
+                # wrappers around records that failed are not failures of their own
+                if "ARXIVID" in text and text.count("{") == 1:
+                    self.failed += 1
+                return None
+        if isinstance(record, dict) and "ARXIVID" not in record:
+            return None
+        record = normalize_record(record)
+        if record is None:
+            self.failed += 1
+        else:
+            self.parsed += 1
+        return record
+
+
+def parse_score_records(text: str):
+    """
+    :return: the score records in text and the number of records that could not be parsed
+    """
+    parser = ScoreRecordParser()
+    records = parser.feed(text)
+    return records, parser.failed
+
+
+def parse_id_list(text: str, known_ids) -> List[str]:
+    """
+    Reads the arxiv ids of the title filter's answer, which should be a JSON list but may come wrapped in text or
+    markdown.
+    :param known_ids: the ids that were asked about, anything else in the answer is ignored
+    :return: the ids, or None if no list could be found
+    """
+    start = text.find("[")
+    end = text.rfind("]")
+    if start == -1 or end < start:
+        return None
+    span = text[start : end + 1]
+    try:
+        ids = json.loads(TRAILING_COMMA.sub(r"\1", span))
+    except ValueError:
+        ids = None
+    if ids is not None and not isinstance(ids, list):
+        return None
+    if ids is None or any(not isinstance(arxiv_id, str) for arxiv_id in ids):
+        # e.g. single quoted ids, or unquoted ones that json reads as numbers (and drops their trailing zeros),
+        # fall back to the known ids in the raw text
+        ids = [token.rstrip(".") for token in ID_TOKEN.findall(span)]
+    return [arxiv_id for arxiv_id in ids if arxiv_id in known_ids]
+
+
+class ParseStats:
+    # counts of how well the model output parsed, shared by the scoring threads
+    def __init__(self):
+        self.counts = {
+            "papers_requested": 0,
+            "papers_scored_first_try": 0,
+            "papers_missing": 0,
+            "malformed_records": 0,
+            "rerequests": 0,
+            "rerequested_papers": 0,
+            "title_batches": 0,
+            "title_batches_unparsed": 0,
+        }
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            for key, value in counts.items():
+                self.counts[key] += value
+
+    def report(self) -> dict:
+        with self._lock:
+            report = dict(self.counts)
+        if report["papers_requested"] > 0:
+            report["first_try_success_rate"] = round(
+                report["papers_scored_first_try"] / report["papers_requested"], 4
+            )
+            report["final_success_rate"] = round(
+                1 - report["papers_missing"] / report["papers_requested"], 4
+            )
+        return report
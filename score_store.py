@@ -0,0 +1,77 @@
+"""
+Durable store of GPT scores per arxiv id. Papers are cross-listed in several categories and show up again
+on replacement days, so anything scored under the same model and prompts is reused instead of rescored.
+"""
+
+import hashlib
+import os
+
+from disk_cache import DiskCache, MISSING
+
+# extra keys of scores aggregated over several samples
+SAMPLE_KEYS = ["RELEVANCE_VARIANCE", "NOVELTY_VARIANCE", "NUM_SAMPLES", "DISAGREEMENT"]
+
+
+def hash_prompts(*prompts: str) -> str:
+    # fingerprint of the prompts and topics, scores are invalidated whenever any of them change
+    digest = hashlib.sha256()
+    for prompt in prompts:
+        digest.update(prompt.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:16]
+
+
+class ScoreStore:
+    def __init__(self, cache: DiskCache, model: str, prompt_hash: str):
+        self.cache = cache
+        self.model = model
+        self.prompt_hash = prompt_hash
+
+    def _key(self, arxiv_id: str) -> str:
+        return arxiv_id + ":" + self.model + ":" + self.prompt_hash
+
+    def get(self, arxiv_id: str):
+        # returns the stored score dict with ARXIVID, COMMENT, RELEVANCE, NOVELTY or None
+        value = self.cache.get(self._key(arxiv_id))
+        if value is MISSING:
+            return None
+        return {
+            key: value[key]
+            for key in ["ARXIVID", "COMMENT", "RELEVANCE", "NOVELTY"] + SAMPLE_KEYS
+            if key in value
+        }
+
+    def set(self, jdict: dict):
+        self.cache.set(
+            self._key(jdict["ARXIVID"]),
+            {
+                "ARXIVID": jdict["ARXIVID"],
+                "COMMENT": jdict.get("COMMENT"),
+                "RELEVANCE": jdict["RELEVANCE"],
+                "NOVELTY": jdict["NOVELTY"],
+                **{key: jdict[key] for key in SAMPLE_KEYS if key in jdict},
+                "model": self.model,
+                "prompt_hash": self.prompt_hash,
+            },
+        )
+
+    def stats(self) -> dict:
+        return self.cache.stats()
+
+    def close(self):
+        self.cache.close()
+
+
+def open_score_store(config, prompt_hash: str, model: str = None):
+    # model defaults to the one in [SELECTION]
+    if not config["CACHE"].getboolean("score_store"):
+        return None
+    return ScoreStore(
+        DiskCache(
+            os.path.join(config["CACHE"]["cache_dir"], "scores.sqlite3"),
+            namespace="paper_scores",
+            ttl=float(config["CACHE"]["score_ttl_days"]) * 24 * 60 * 60,
+        ),
+        model or config["SELECTION"]["model"],
+        prompt_hash,
+    )
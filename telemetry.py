@@ -0,0 +1,198 @@
+"""
+Timings, counters and LLM token/cost accounting of a run, so that daily runs can be compared and regressions spotted.
+Stages are timed with spans, which can be used as a context manager or a decorator:
+
+    with metrics.span("push_to_slack"):
+        ...
+
+Spans of the same name add up, so a span around each GPT batch reports the number of batches and their total
+and slowest time. Spans of concurrent stages overlap, so their times can add up to more than the run's wall-clock
+time. At the end of the run, the metrics are written to out/metrics.json and optionally to out/metrics.prom in the
+Prometheus text format (e.g. for the node exporter's textfile collector).
+"""
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, Tuple
+
+PROMETHEUS_PREFIX = "paper_assistant_"
+
+
+def series_name(name: str, labels: Tuple[Tuple[str, str], ...]) -> str:
+    # name{label="value",...} as in the Prometheus text format
+    if len(labels) == 0:
+        return name
+    return (
+        name
+        + "{"
+        + ",".join(key + '="' + str(value) + '"' for key, value in labels)
+        + "}"
+    )
+
+
+class Metrics:
+    def __init__(self):
+        self.started_at = datetime.now(timezone.utc)
+        self._start = time.perf_counter()
+        # span name -> count, total and max seconds
+        self.spans = {}
+        # (name, labels) -> value
+        self.counters = {}
+        # stage -> requests, tokens and cost of the LLM calls of the stage
+        self.llm = {}
+        # reports of other components, e.g. cache stats, copied into the json as they are
+        self.reports = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                span = self.spans.setdefault(
+                    name, {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0}
+                )
+                span["count"] += 1
+                span["total_seconds"] += seconds
+                span["max_seconds"] = max(span["max_seconds"], seconds)
+
+    def count(self, name: str, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def record_llm(
+        self, stage: str, usage, cost: float, cached_tokens: int = 0, cache_hit=False
+    ):
+        """
+        :param usage: token usage of the completion
+        :param cost: what the completion cost
+        :param cached_tokens: prompt tokens of the completion served from the provider's prompt cache
+        :param cache_hit: the completion was served from the completion cache, so it made no request
+        """
+        with self._lock:
+            llm = self.llm.setdefault(
+                stage,
+                {
+                    "requests": 0,
+                    "cache_hits": 0,
+                    "prompt_tokens": 0,
+                    "cached_prompt_tokens": 0,
+                    "completion_tokens": 0,
+                    "cost": 0.0,
+                },
+            )
+            if cache_hit:
+                llm["cache_hits"] += 1
+                return
+            llm["requests"] += 1
+            llm["prompt_tokens"] += usage.prompt_tokens
+            llm["cached_prompt_tokens"] += cached_tokens
+            llm["completion_tokens"] += usage.completion_tokens
+            llm["cost"] += cost
+
+    def attach(self, name: str, report: dict):
+        with self._lock:
+            self.reports[name] = report
+
+    def report(self) -> dict:
+        with self._lock:
+            spans = {name: dict(span) for name, span in self.spans.items()}
+            counters = {
+                series_name(name, labels): value
+                for (name, labels), value in sorted(self.counters.items())
+            }
+            llm = {stage: dict(stats) for stage, stats in self.llm.items()}
+            reports = dict(self.reports)
+        for span in spans.values():
+            span["total_seconds"] = round(span["total_seconds"], 4)
+            span["max_seconds"] = round(span["max_seconds"], 4)
+        return {
+            "started_at": self.started_at.isoformat(),
+            "wall_seconds": round(time.perf_counter() - self._start, 4),
+            "spans": spans,
+            "counters": counters,
+            "llm": llm,
+            "total_cost": sum(stats["cost"] for stats in llm.values()),
+            **reports,
+        }
+
+    def prometheus_text(self) -> str:
+        report = self.report()
+        lines = []
+
+        def add(name, kind, samples: Dict[str, float]):
+            name = PROMETHEUS_PREFIX + name
+            lines.append("# TYPE " + name + " " + kind)
+            for labels, value in samples.items():
+                lines.append(name + labels + " " + repr(float(value)))
+
+        add("run_seconds", "gauge", {"": report["wall_seconds"]})
+        add(
+            "run_started_timestamp_seconds",
+            "gauge",
+            {"": self.started_at.timestamp()},
+        )
+        for field, suffix in [
+            ("count", "spans_total"),
+            ("total_seconds", "span_seconds_total"),
+            ("max_seconds", "span_max_seconds"),
+        ]:
+            add(
+                suffix,
+                "counter" if suffix != "span_max_seconds" else "gauge",
+                {
+                    series_name("", (("span", name),)): span[field]
+                    for name, span in report["spans"].items()
+                },
+            )
+        with self._lock:
+            counters = sorted(self.counters.items())
+        names = list(dict.fromkeys(name for (name, _), _ in counters))
+        for name in names:
+            add(
+                name + "_total",
+                "counter",
+                {
+                    series_name("", labels): value
+                    for (counter, labels), value in counters
+                    if counter == name
+                },
+            )
+        for field in [
+            "requests",
+            "cache_hits",
+            "prompt_tokens",
+            "cached_prompt_tokens",
+            "completion_tokens",
+            "cost",
+        ]:
+            add(
+                "llm_" + field + ("_usd" if field == "cost" else "") + "_total",
+                "counter",
+                {
+                    series_name("", (("stage", stage),)): stats[field]
+                    for stage, stats in report["llm"].items()
+                },
+            )
+        return "\n".join(lines) + "\n"
+
+    def write(self, config):
+        # writes metrics.json (and metrics.prom) to the output path, as enabled in [OUTPUT]
+        output_path = config["OUTPUT"]["output_path"]
+        if config["OUTPUT"].getboolean("dump_metrics"):
+            with open(output_path + "metrics.json", "w") as outfile:
+                json.dump(self.report(), outfile, indent=4)
+        if config["OUTPUT"].getboolean("dump_prometheus"):
+            with open(output_path + "metrics.prom", "w") as outfile:
+                outfile.write(self.prometheus_text())
+
+
+# the metrics of this run, shared by all modules
+metrics = Metrics()
@@ -0,0 +1,42 @@
+"""
+Token counting for prompts. Uses tiktoken when it is installed and its encodings can be loaded,
+and otherwise a local approximation that is close enough for batching and rate limiting.
+"""
+
+import functools
+import re
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# words and single punctuation marks are about one token each, long words get split into a few
+APPROX_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model: str):
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            # models tiktoken does not know about, e.g. ones served locally
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as ex:
+        # tiktoken downloads its encodings on first use, which can fail when offline
+        print("Failed to load tiktoken encoding, approximating token counts " + str(ex))
+        return None
+
+
+def approximate_token_count(text: str) -> int:
+    return sum(1 + len(piece) // 8 for piece in APPROX_TOKEN_PATTERN.findall(text))
+
+
+def count_tokens(text: str, model: str = "gpt-4") -> int:
+    encoding = get_encoding(model)
+    if encoding is None:
+        return approximate_token_count(text)
+    return len(encoding.encode(text, disallowed_special=()))